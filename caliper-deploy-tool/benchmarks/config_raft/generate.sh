@@ -1,23 +1,59 @@
 #!/usr/bin/env bash
+# 任一步骤失败立即退出, make generate随之失败
+set -e
 
 : "${FABRIC_VERSION:=1.4.4}"
 : "${FABRIC_CA_VERSION:=1.4.4}"
+# 以crypto-config.yaml/configtx.yaml内容的hash为key缓存生成结果
+: "${CACHE_DIR:=.cache}"
 
 # if the binaries are not available, download them
 if [[ ! -d "bin" ]]; then
   curl -sSL http://bit.ly/2ysbOFE | bash -s -- ${FABRIC_VERSION} ${FABRIC_CA_VERSION} 0.4.14 -ds
 fi
 
-rm -rf ./crypto-config/
-rm -f ./genesis.block
-rm -f ./mychannel.tx
+CRYPTO_KEY=$(sha256sum crypto-config.yaml | cut -d' ' -f1)
+# genesis中包含MSP证书, key同时依赖crypto-config.yaml
+GENESIS_KEY=$(cat crypto-config.yaml configtx.yaml | sha256sum | cut -d' ' -f1)
+CRYPTO_CACHE=${CACHE_DIR}/crypto-${CRYPTO_KEY}
+GENESIS_CACHE=${CACHE_DIR}/genesis-${GENESIS_KEY}
+mkdir -p ${CACHE_DIR}
+
+# 先生成到临时目录, 两个工具都成功后才mv为缓存目录, 失败的运行不会留下半成品缓存
+TMP_DIR=$(mktemp -d ${CACHE_DIR}/tmp.XXXXXX)
+trap 'rm -rf ${TMP_DIR}' EXIT
 
-./bin/cryptogen generate --config=./crypto-config.yaml
-./bin/configtxgen -profile OrdererGenesis -outputBlock genesis.block -channelID syschannel
-./bin/configtxgen -profile ChannelConfig -outputCreateChannelTx mychannel.tx -channelID mychannel
+if [[ -d "${CRYPTO_CACHE}" ]]; then
+  echo "crypto-config cache hit: ${CRYPTO_KEY}"
+else
+  echo "crypto-config cache miss: ${CRYPTO_KEY}"
+  ./bin/cryptogen generate --config=./crypto-config.yaml --output=${TMP_DIR}/crypto-config
 
-# Rename the key files we use to be key.pem instead of a uuid
-for KEY in $(find crypto-config -type f -name "*_sk"); do
-    KEY_DIR=$(dirname ${KEY})
-    mv ${KEY} ${KEY_DIR}/key.pem
-done
+  # Rename the key files we use to be key.pem instead of a uuid
+  for KEY in $(find ${TMP_DIR}/crypto-config -type f -name "*_sk"); do
+      KEY_DIR=$(dirname ${KEY})
+      mv ${KEY} ${KEY_DIR}/key.pem
+  done
+  mv ${TMP_DIR}/crypto-config ${CRYPTO_CACHE}
+fi
+# 当前目录已是同一份crypto时无需复制
+if [[ ! -d "crypto-config" || "$(cat .crypto-key 2>/dev/null)" != "${CRYPTO_KEY}" ]]; then
+  rm -rf ./crypto-config/ .crypto-key
+  cp -r ${CRYPTO_CACHE} ./crypto-config
+fi
+echo ${CRYPTO_KEY} > .crypto-key
+
+rm -f ./genesis.block
+rm -f ./mychannel.tx
+if [[ -f "${GENESIS_CACHE}/genesis.block" && -f "${GENESIS_CACHE}/mychannel.tx" ]]; then
+  echo "genesis cache hit: ${GENESIS_KEY}"
+else
+  echo "genesis cache miss: ${GENESIS_KEY}"
+  # configtxgen读取./crypto-config中的MSP
+  mkdir -p ${TMP_DIR}/genesis
+  ./bin/configtxgen -profile OrdererGenesis -outputBlock ${TMP_DIR}/genesis/genesis.block -channelID syschannel
+  ./bin/configtxgen -profile ChannelConfig -outputCreateChannelTx ${TMP_DIR}/genesis/mychannel.tx -channelID mychannel
+  rm -rf ${GENESIS_CACHE}
+  mv ${TMP_DIR}/genesis ${GENESIS_CACHE}
+fi
+cp ${GENESIS_CACHE}/genesis.block ${GENESIS_CACHE}/mychannel.tx .
@@ -13,10 +13,13 @@ else
 fi
 
 
-docker rm cdt
+# 多集群时每个控制器使用不同的容器名, 如cdt-g0
+CDT_CONTAINER=${CDT_CONTAINER:-cdt}
+
+docker rm ${CDT_CONTAINER}
 
 docker run -v  ${CDTHOME}:/hyperledger/caliper/workspace \
---dns ${CDTIP} --name=cdt \
+--dns ${CDTIP} --name=${CDT_CONTAINER} \
 cdt caliper launch master \
 --caliper-workspace  /hyperledger/caliper/workspace \
 --caliper-benchconfig dist/config-distributed.yaml \
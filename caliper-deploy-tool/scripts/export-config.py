@@ -1,5 +1,6 @@
 import yaml
 import os
+import fcntl
 import pdb
 import sys
 from jinja2 import Environment,FileSystemLoader
@@ -76,15 +77,16 @@ def genCC(config):
 
     orgdict = {}
 
-    crypto_config["orderer_count"] = len(config['fabric-network']['orderer'])
+    # cryptogen按主机名生成证书, group模式下orderer/peer编号不一定从0开始
+    crypto_config["orderers"] = [orderer.split(".")[0] for orderer in config['fabric-network']['orderer']]
 
     for org in config['client']['orgs']:
         orgdict["org"] = org
-        peer_num = 0
+        peers = []
         set_anchor = False
         for peer in config['fabric-network']['peer']:
             if peer.find(org) != -1:
-                peer_num += 1
+                peers.append(peer.split(".")[0])
                 if not set_anchor:
                     orgdict["anchorpeer"] = {
                         "name": peer,
@@ -95,7 +97,7 @@ def genCC(config):
                     orgdict = {}
         crypto_config["peerorgs"].append({
             "orgname": org + ".example.com",
-            "count": peer_num
+            "peers": peers
         })
     for orderer in config['fabric-network']['orderer']:
                 configtx_config["orderers"].append({
@@ -158,7 +160,7 @@ def render(config, dnsfile, action):
 
     res.append({
         'filename': 'crypto-config.yaml',
-        'yaml': tpl_crypto.render(orderer_count=crypto_conf["orderer_count"], peerorgs=crypto_conf["peerorgs"])
+        'yaml': tpl_crypto.render(orderers=crypto_conf["orderers"], peerorgs=crypto_conf["peerorgs"])
         })
 
     res.append({
@@ -181,19 +183,57 @@ def export(arr):
 
 def evalgroup(config, groupid="none"):
     """
-    按group生成配置
+    按group生成配置, 只保留group中的peer/orderer/ca
+    各group的节点使用独立的crypto子目录、账本目录和docker网络, 可与其他group部署在同一主机
     """
     logging.info("Entered Group Mode!    GroupID: " + groupid)
-    drop = []
-    for key in config['fabric-network']['peer']:
-        if key not in config['caliper-eval']['group'][groupid]:
-            drop.append(key)
-            
-    for key in drop:
-        del config['fabric-network']['peer'][key]
+    members = config['caliper-eval']['group'][groupid]
+    for tp in ('peer', 'orderer', 'ca'):
+        nodes = config['fabric-network'].get(tp) or {}
+        drop = [key for key in nodes if key not in members]
+        for key in drop:
+            del nodes[key]
+        for key in nodes:
+            # 节点共享common锚点, 复制后再修改
+            node = dict(nodes[key])
+            node['mountpath'] = node['mountpath'] + '/' + groupid
+            node['ledgerpath'] = '/root/ansible/%s/production' % groupid
+            node['network'] = '%s_default' % groupid
+            nodes[key] = node
     # logging.debug(config['fabric-network']['peer'])
     return config
 
+def mergehosts(dnsconfig, shared):
+    """
+    把本group的域名合并到CoreDNS共享的hostsfile, 保留其他group的记录
+    同一域名在其他group中指向不同主机时无法共用一个CoreDNS, 直接报错
+    """
+    entries = {}
+    with open(dnsconfig) as f:
+        for line in f:
+            if line.strip():
+                host, name = line.split()
+                entries[name] = host
+    with open(shared, 'a+') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.seek(0)
+        lines = []
+        for line in f:
+            if not line.strip():
+                continue
+            host, name = line.split()
+            if name in entries:
+                if entries[name] != host:
+                    raise RuntimeError("%s is mapped to %s by another group, "
+                        "run this group on a separate CDT host or rename the node" % (name, host))
+                continue
+            lines.append(line)
+        lines += ['%s   %s\n' % (entries[name], name) for name in entries]
+        f.seek(0)
+        f.truncate()
+        f.writelines(lines)
+        fcntl.flock(f, fcntl.LOCK_UN)
+
 
 
 if __name__ == '__main__':
@@ -205,6 +245,8 @@ if __name__ == '__main__':
     if len(sys.argv) == 3:
         # Enter Group Mode 
         config = evalgroup(config, sys.argv[2])
+    # 增量部署时channel已存在, caliper不再创建channel
+    config['client']['created'] = os.environ.get('CHANNEL_CREATED', 'false') == 'true'
 
     # pdb.set_trace()
     env = Environment(loader = FileSystemLoader('templates'))
@@ -212,6 +254,8 @@ if __name__ == '__main__':
     dnsfile = open(DNS_CONFIG, 'w')
     arr = render(config, dnsfile, config_action)
     export(arr)
+    if os.environ.get('SHARED_HOSTSFILE'):
+        mergehosts(DNS_CONFIG, os.environ['SHARED_HOSTSFILE'])
 
     logging.info("Finished!")
 
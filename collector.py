@@ -1,7 +1,11 @@
 import requests
 from utils.metrics import Metrics
-import pandas as pd
-import numpy as np
+from utils.http import make_session
+from utils.report import CaliperReport
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
 import pdb
 
 class Collector(object):
@@ -9,9 +13,14 @@ class Collector(object):
     收集caliper和prometheus信息
     params:
     endpoints: 必须包含peer和orderer两种类型的节点信息
+    max_workers: 并发抓取Prometheus的线程数
+    deadline: 单次抓取所有节点的总超时时间(s)，超时的节点不计入结果, 应小于采样间隔
+              超时的抓取无法取消, 在其返回前再次抓取该endpoint时(如采样线程和/cdt/metrics同时抓取)
+              等待这次抓取的结果, 不会重复提交
+    session: 共享的requests.Session，为None时按max_workers创建连接池(不重试，避免超出deadline)
     """
 
-    def __init__(self, endpoints, reportfile, channel, chaincode):
+    def __init__(self, endpoints, reportfile, channel, chaincode, max_workers=16, deadline=5, session=None):
         _nPeers  = 0
         _nOrderers = 0
         for item in endpoints:
@@ -23,9 +32,21 @@ class Collector(object):
         assert(_nPeers > 0)
 
         self._report = reportfile
+        self._report_reader = CaliperReport(reportfile)
         self._channel = channel
         self._chaincode = chaincode
         self._endpoints = endpoints
+        self._deadline = deadline
+        self._executor = ThreadPoolExecutor(max_workers)
+        # 每个endpoint仍在执行的抓取, url -> future, 抓取结束时移除
+        self._inflight = {}
+        # submit时若抓取已完成, done回调在持锁的线程中立即执行, 需要可重入
+        self._inflight_lock = threading.RLock()
+        self._session = session if session is not None else make_session(pool_size=max_workers, retries=0)
+        # 最近一次抓取每个endpoint的状态
+        self._scrape_status = {}
+        # 各样本的Prometheus类型, 随抓取累积
+        self._metric_types = {}
         self._filters = {
             "peer": [
                 "chaincode_shim_request_duration_sum", 
@@ -128,54 +149,144 @@ class Collector(object):
             res = res + "_" + index + "_" + str(input[index])
         return res
 
+    def _scrape(self, metrics_interpreter):
+        """
+        抓取单个endpoint，返回({bucket: metrics列表}, 状态)
+        """
+        start = time.time()
+        buckets = metrics_interpreter.interprete_buckets(timeout=self._deadline)
+        status = {
+            "status": "ok" if metrics_interpreter.error is None else "error",
+            "error": metrics_interpreter.error,
+            "elapsed": time.time() - start
+        }
+        return buckets, status, metrics_interpreter.types
+
+    def _release(self, url, future):
+        with self._inflight_lock:
+            if self._inflight.get(url) is future:
+                del self._inflight[url]
+
+    def _clean(self, metrics_lists):
+        """
+        数据清洗: 按channel和chaincode筛选并展开label
+        """
+        data = {}
+        for item in metrics_lists:
+            if item['label'] == {}:
+                data[item['key']] = item['value']
+            elif 'chaincode' in item['label']:
+                # TODO: 此处限制使用智能合约
+                if item['label']['chaincode'].find(self._chaincode) != -1:
+                    data[item['key'] + self._convert_dict2name(item['label'])] = item['value']
+
+            elif 'channel' in item['label']:
+                # TODO: 此处限制使用channel
+                if item['label']['channel'].find(self._channel) != -1:
+                    data[item['key'] + '*' + self._convert_dict2name(item['label'])] = item['value']
+            else:
+                data[item['key']] = item['value']
+        return data
+
     def collect_from_prometheus(self, handler=None):
+        """
+        并发抓取所有节点，deadline内未返回的节点被丢弃(部分结果)，
+        每个endpoint的状态见get_scrape_status()
+        """
+        results = {}
+        for bucket, data in self.collect_by_endpoint().items():
+            results[bucket] = list(data.values())
+
+        if handler:
+            results = handler(results)
+        return results
+
+    def collect_by_endpoint(self):
+        """
+        同collect_from_prometheus, 但保留endpoint标识
+        return: {bucket: OrderedDict(url -> data)}
+        """
         results = {
-            "peer": [],
-            "orderer": [],
-            "peer-net":[],
-            # "orderer-net":[]
+            "peer": OrderedDict(),
+            "orderer": OrderedDict(),
+            "peer-net": OrderedDict(),
+            # "orderer-net": OrderedDict()
         }
 
         _metricsobjs = self._get_metadata_from_prom()
-        for node_type in results:
-            for  metrics_interpreter in _metricsobjs[node_type]:
-                metrics_lists = metrics_interpreter.interprete()
-                # 数据清洗
-                # pdb.set_trace()
-                data = {}
-                for item in metrics_lists:
-                    if item['label'] == {}:
-                        data[item['key']] = item['value']
-                    elif 'chaincode' in item['label']:
-                        # TODO: 此处限制使用智能合约
-                        if item['label']['chaincode'].find(self._chaincode) != -1:
-                            data[item['key'] + self._convert_dict2name(item['label'])] = item['value']
-
-                    elif 'channel' in item['label']:
-                        # TODO: 此处限制使用channel
-                        if item['label']['channel'].find(self._channel) != -1:
-                            data[item['key'] + '*' + self._convert_dict2name(item['label'])] = item['value']
-                    else:
-                        data[item['key']] = item['value']
-                results[node_type].append(data)
-        if handler:
-            results = handler(results)
+        futures = []
+        with self._inflight_lock:
+            for item in _metricsobjs:
+                url = item[1].url
+                future = self._inflight.get(url)
+                if future is None:
+                    future = self._executor.submit(self._scrape, item[1])
+                    self._inflight[url] = future
+                    future.add_done_callback(lambda f, url=url: self._release(url, f))
+                # 其他调用者的抓取还未返回时共享其结果, 每个endpoint最多一个抓取在执行
+                futures.append((item, future))
+        wait([future for _, future in futures], timeout=self._deadline)
+
+        scrape_status = {}
+        # 按endpoint顺序组装结果，保证各节点顺序稳定
+        for (node_type, metrics_interpreter), future in futures:
+            if future.done() and not future.cancelled():
+                buckets, status, types = future.result()
+                status = dict(status)
+                if status["status"] == "ok":
+                    for bucket in buckets:
+                        results[bucket][metrics_interpreter.url] = self._clean(buckets[bucket])
+                    self._metric_types.update(types)
+            else:
+                # 可能被其他调用者共享, 不取消, 结束后由回调移除
+                status = {"status": "timeout", "error": None, "elapsed": self._deadline}
+            status["node_type"] = node_type
+            scrape_status[metrics_interpreter.url] = status
+        self._scrape_status = scrape_status
         return results
 
+    def close(self):
+        """
+        关闭抓取线程池, 未开始的抓取被取消, 已超时仍在执行的抓取不再等待
+        """
+        with self._inflight_lock:
+            for future in self._inflight.values():
+                future.cancel()
+            self._inflight = {}
+        self._executor.shutdown(wait=False)
+        self._session.close()
+
+    def get_metric_types(self):
+        """
+        return: {样本名: counter|gauge|histogram|summary}
+        """
+        return dict(self._metric_types)
+
+    def get_scrape_status(self):
+        """
+        最近一次collect_from_prometheus的各endpoint状态
+        {url: {"node_type": str, "status": ok|error|timeout, "error": str, "elapsed": s}}
+        """
+        return self._scrape_status
+
     def _get_metadata_from_prom(self):
-        metrics_res = {
-            "peer": [],
-            "orderer": [],
-            "peer-net":[],
-            # "orderer-net":[]
-        }
+        """
+        每个endpoint只创建一个Metrics, 一次抓取分发到多个bucket
+        peer -> peer, peer-net; orderer -> orderer
+        return: [(node_type, Metrics)]
+        """
+        metrics_res = []
         for item in self._endpoints:
             if item["node_type"] == "peer":
-                metrics_res["peer"].append(Metrics(item["url"], self._filters["peer"]))
-                metrics_res["peer-net"].append(Metrics(item["url"], self._filters["peer-net"]))
+                metrics_res.append(("peer", Metrics(item["url"], {
+                    "peer": self._filters["peer"],
+                    "peer-net": self._filters["peer-net"]
+                }, session=self._session)))
             elif item["node_type"] == "orderer":
-                metrics_res["orderer"].append(Metrics(item["url"], self._filters["orderer"]))
-                # metrics_res["orderer-net"].append(Metrics(item["url"], self._filters["orderer-net"]))
+                metrics_res.append(("orderer", Metrics(item["url"], {
+                    "orderer": self._filters["orderer"],
+                    # "orderer-net": self._filters["orderer-net"]
+                }, session=self._session)))
         return metrics_res
 
     def collect_from_caliper(self):
@@ -185,29 +296,12 @@ class Collector(object):
         2. CPU(%)
         3. Memory(MB)
         4. Latency(s)
+        以及发送速率、成功/失败数、延迟(ms)和各容器资源占用, 见CaliperReport.read
+        report.html未变化时直接返回缓存结果
         """
-        html = pd.read_html(self._report)
-        orderer_flag = np.bitwise_not(html[2]["Name"].str.contains("orderer"))
-        ca_flag = np.bitwise_not(html[2]["Name"].str.contains("ca"))
-        try:
-            data = html[2][orderer_flag & ca_flag].mean(numeric_only=True)
-            CPU = data["CPU%(avg)"]
-            Mem = data["Memory(avg) [MB]"]
-        except Exception:
-            CPU = 0.0
-            Mem = 0.0
-        
-        Latency = html[1]["Avg Latency (s)"][0]
-        TPS = html[1]["Throughput (TPS)"][0]
-        
-        return {
-            "CPU": CPU,
-            "Mem": Mem,
-            "Latency": Latency,
-            "TPS": TPS
-        }
+        return self._report_reader.read()
+
 
-    
 
 
 # test
@@ -0,0 +1,134 @@
+import os
+import queue
+import re
+import signal
+import subprocess
+import threading
+import time
+
+# ansible每个task在每台主机上的结果行, 如"changed: [192.168.0.123]"
+_HOST_RESULT = re.compile(r"^(ok|changed|skipping|fatal|failed|unreachable): \[([^\]]+)\]")
+# PLAY RECAP中每台主机的统计行
+_HOST_RECAP = re.compile(r"^(\S+)\s*:\s*ok=\d+.*?unreachable=(\d+)\s+failed=(\d+)")
+# 失败结果后等待"...ignoring"的时间(s), 超时即视为失败
+_IGNORE_WAIT = 1
+
+
+class DeployExecutor(object):
+    """
+    执行caliper-deploy-tool的make目标, 主机级并发由一次ansible-playbook的
+    strategy: free和--forks完成
+    params:
+    workdir: caliper-deploy-tool目录
+    group: ansible inventory中的主机组, 作为--limit传给playbook
+    fan_out: 同时部署的主机数(ansible --forks)
+    env: 执行make时额外导出的环境变量, 如{"CDTIP": ...}
+    """
+
+    def __init__(self, workdir="caliper-deploy-tool", group="cdt", fan_out=8, env=None):
+        self._workdir = workdir
+        self._group = group
+        self._fan_out = fan_out
+        self._env = env or {}
+        self._procs = set()
+        self._lock = threading.Lock()
+
+    def _shell(self, cmd):
+        return "".join("export %s=%s; " % item for item in self._env.items()) + cmd
+
+    def _popen(self, cmd, **kwargs):
+        # 新的进程组, terminate时连同make/ansible-playbook子进程一起终止
+        proc = subprocess.Popen(self._shell(cmd), shell=True, cwd=self._workdir,
+            start_new_session=True, **kwargs)
+        with self._lock:
+            self._procs.add(proc)
+        return proc
+
+    def _release(self, proc):
+        with self._lock:
+            self._procs.discard(proc)
+
+    def call(self, cmd):
+        """
+        在workdir中执行shell命令, 返回returncode
+        """
+        proc = self._popen(cmd)
+        try:
+            return proc.wait()
+        finally:
+            self._release(proc)
+
+    def make(self, target, check=True):
+        """
+        执行单个make目标, check为True时返回码非0抛出RuntimeError
+        """
+        rc = self.call("make %s" % target)
+        if check and rc != 0:
+            raise RuntimeError("make %s failed with code %d" % (target, rc))
+        return rc
+
+    @staticmethod
+    def _read_lines(stream, lines):
+        for line in stream:
+            lines.put(line)
+        lines.put(None)
+
+    def fan_out(self, target, fail_fast=True):
+        """
+        以--forks fan_out --limit group执行一次playbook目标, 从输出中记录各主机耗时
+        fail_fast: 任一主机失败时终止整个playbook并抛出RuntimeError
+        return: {host: 该主机最后一个task完成时的耗时(s)}
+        """
+        start = time.time()
+        timings = {}
+        failed = set()
+        proc = self._popen("make %s FORKS=%d HOST=%s" % (target, self._fan_out, self._group),
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+        lines = queue.Queue()
+        reader = threading.Thread(target=self._read_lines, args=(proc.stdout, lines), daemon=True)
+        reader.start()
+        try:
+            # 失败结果的下一行为"...ignoring"时是ignore_errors, 不算失败
+            suspect = None
+            while True:
+                try:
+                    line = lines.get(timeout=_IGNORE_WAIT if suspect is not None else None)
+                except queue.Empty:
+                    line = ""
+                if suspect is not None:
+                    if not line.strip().startswith("...ignoring"):
+                        failed.add(suspect)
+                        if fail_fast:
+                            self.terminate()
+                    suspect = None
+                if line is None:
+                    break
+                print(line, end="")
+                match = _HOST_RESULT.match(line)
+                if match is not None:
+                    result, host = match.groups()
+                    timings[host] = round(time.time() - start, 3)
+                    if result in ("fatal", "failed", "unreachable"):
+                        suspect = host
+                    continue
+                match = _HOST_RECAP.match(line)
+                if match is not None and (int(match.group(2)) or int(match.group(3))):
+                    failed.add(match.group(1))
+            rc = proc.wait()
+        finally:
+            self._release(proc)
+        if fail_fast and (failed or rc != 0):
+            hosts = ", ".join(sorted(failed)) if failed else "unknown hosts"
+            raise RuntimeError("make %s failed on %s (code %d)" % (target, hosts, rc))
+        return timings
+
+    def terminate(self):
+        """
+        终止所有正在执行的命令及其子进程
+        """
+        with self._lock:
+            for proc in self._procs:
+                try:
+                    os.killpg(proc.pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
@@ -28,6 +28,26 @@ class Deployer(object):
         yaml_data = self._inter2yaml(config_inter)
         utils.save_config(yaml_data, self._target_file)
 
+    def load_target(self):
+        """
+        读取当前的action.yaml
+        """
+        return utils.load_config(self._target_file)
+
+    @staticmethod
+    def diff(old_yaml, new_yaml):
+        """
+        比较两份action.yaml
+        return: 参数发生变化的分组集合, 如{"configtx", "orderer", "peer"}
+        """
+        if old_yaml is None:
+            return set(new_yaml)
+        changed = set()
+        for item in set(old_yaml) | set(new_yaml):
+            if old_yaml.get(item) != new_yaml.get(item):
+                changed.add(item)
+        return changed
+
 
     def _yaml2inter(self, yaml_data):
         res = defaultdict(dict)
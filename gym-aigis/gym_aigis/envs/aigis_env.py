@@ -8,8 +8,13 @@ import json
 import time
 import pdb
 
+from gym_aigis.envs.http import make_session
+
 url = "http://127.0.0.1:5000/cdt"
 
+# 复用keep-alive连接，避免轮询状态时每次新建TCP连接
+session = make_session(pool_size=4)
+
 
 
 class AigisEnv(gym.Env):
@@ -83,7 +88,7 @@ class AigisEnv(gym.Env):
         return dict_data
 
     def _get_action_limits(self):
-        response = requests.request("GET", url + "/action/limits")
+        response = session.request("GET", url + "/action/limits")
         limits = json.loads(response.text)
         return limits
     
@@ -91,7 +96,7 @@ class AigisEnv(gym.Env):
         if 'current_reward_params' in dir(self):
             self.last_reward_params = self.current_reward_params
 
-        response = requests.request("GET", url + "/metrics")
+        response = session.request("GET", url + "/metrics")
         state = json.loads(response.text)
         self.current_reward_params = {
             "Latency": state['caliper']['Latency'],
@@ -125,11 +130,11 @@ class AigisEnv(gym.Env):
         """
         使用默认参数先跑一次CDT获取状态信息，Reward等
         """
-        response = requests.request("POST", url + "/deploy/default")
+        response = session.request("POST", url + "/deploy/default")
         print("__init_cdt:\t", response.text)
         time.sleep(1)
         total_iteration = 0
-        while not self._check_cdt_status():
+        while not self._check_cdt_done():
             time.sleep(3)
             total_iteration += 1
 
@@ -152,11 +157,11 @@ class AigisEnv(gym.Env):
         headers = {
         'Content-Type': 'application/json'
         }
-        response = requests.request("POST", url + "/deploy/up", headers=headers, data=json.dumps(output_config_dict))
+        response = session.request("POST", url + "/deploy/up", headers=headers, data=json.dumps(output_config_dict))
         # print("deploy_result:\t" + response.text)
         time.sleep(1)
         total_iteration = 0
-        while not self._check_cdt_status():
+        while not self._check_cdt_done():
             time.sleep(3)
             total_iteration += 1
             # if(total_iteration % 10 == 0):
@@ -164,7 +169,7 @@ class AigisEnv(gym.Env):
         # return True if response.text == "Good" else False
 
     def stop_cdt(self):
-        response = requests.request("DELETE", url + "/deploy/down")
+        response = session.request("DELETE", url + "/deploy/down")
         # print(response.text)
         time.sleep(1)
         total_iteration = 0
@@ -178,9 +183,16 @@ class AigisEnv(gym.Env):
 
     
     def _check_cdt_status(self):
-        response = requests.request("GET", url + "/action/status")
+        response = session.request("GET", url + "/action/status")
         return False if response.text == "Not Found" else True
 
+    def _check_cdt_done(self):
+        """
+        部署任务结束: 有新的report(Exist)或任务失败(Retry), Running时report可能仍是上一步的
+        """
+        response = session.request("GET", url + "/action/status")
+        return response.text in ("Exist", "Retry")
+
     def _normalization(self, state):
         # min-max 归一化
         df_state = pd.DataFrame(state['prom']).astype('float')
@@ -0,0 +1,27 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+def make_session(pool_size=16, retries=3, backoff=0.3):
+    """
+    创建带连接池(keep-alive)和重试的requests.Session
+    与仓库根目录utils/http.py中控制器使用的make_session相同, 修改时需同步
+    params:
+    pool_size: 每个host的连接池大小，应不小于并发线程数
+    retries: 连接失败/5xx时的重试次数, 只重试GET/HEAD;
+             POST/DELETE会提交任务, 5xx前可能已被服务端接收, 重试会重复提交
+    backoff: 重试的指数退避系数(s)
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset(["GET", "HEAD"]),
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
@@ -1 +1,4 @@
-from .env import AigisEnv
\ No newline at end of file
+from .env import AigisEnv
+from .vec_env import VecAigisEnv
+from .surrogate import SurrogateAigisEnv
+from .simulator import AigisSimulator
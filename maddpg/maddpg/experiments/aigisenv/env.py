@@ -2,13 +2,21 @@ import gym
 from gym import error, spaces, utils
 from gym.utils import seeding
 import numpy as np
-import pandas as pd
 import requests
 import json
 import time
 import pdb
+from concurrent.futures import ThreadPoolExecutor
+
+from .client import make_session
+from .features import FeatureDeriver, FeatureSchema
 
 url = "http://127.0.0.1:5000/cdt"
+# 长轮询单次阻塞时间(s)
+WAIT_TIMEOUT = 60
+# 任务队列满(429)时的重试次数和最长退避时间(s)
+SUBMIT_RETRIES = 8
+SUBMIT_BACKOFF_MAX = 60
 
 
 
@@ -21,12 +29,29 @@ class AigisEnv(gym.Env):
     """
     # metadata = {'render.modes': ['human']}   
 
-    def __init__(self, booted=True, act_importance=53):
+    def __init__(self, booted=True, act_importance=53, session=None, obs_source="prom", derive_features=False,
+                 url=url, metadata_file="./obs-metadata.npy"):
         """
         params:
         booted: 标识是否已经有初始化数据
         act_importance: 调整的action参数数量, 需要加1
+        session: 访问CDT控制器的requests.Session, 为None时创建keep-alive连接池
+        obs_source: obs来源, "prom"为benchmark结束后的单次抓取,
+                    "window"为benchmark期间采样得到的delta/rate/p50/p95
+        derive_features: 将prom中的counter转换为速率, _sum/_count转换为均值
+        url: CDT控制器地址, 多集群时每个集群一个控制器
+        metadata_file: 初始state的保存路径
         """
+        assert not (derive_features and obs_source == "window")
+        self._url = url
+        self._session = session if session is not None else make_session(pool_size=4)
+        self._obs_source = obs_source
+        self._deriver = FeatureDeriver() if derive_features else None
+        # 长轮询返回的metrics, 由_collect_state消费
+        self._pending_state = None
+        # step_async在后台线程中执行step, 同一时间最多一个step
+        self._step_executor = None
+        self._step_future = None
         # 重要性排序action列表
         self._internal_actions = [
             'CORE_PEER_GOSSIP_STATE_BLOCKBUFFERSIZE',
@@ -93,6 +118,8 @@ class AigisEnv(gym.Env):
         self._action_limits = self._get_action_limits()
         self._max_list = np.array(self._action_dict2list(self._action_limits, index=True), dtype=object).copy()
         self._obs_limits = None
+        self._schema = None
+        self.obs_stale = False
         self._obs_shape_dict = None
         
 
@@ -101,10 +128,10 @@ class AigisEnv(gym.Env):
             initial_reward_params = self._collect_state()
             
             print("Saved to metadata.")
-            self.save_config(initial_reward_params, "./obs-metadata.npy")
+            self.save_config(initial_reward_params, metadata_file)
         else:
             print("Loaded from metadata.")
-            initial_reward_params = self.load_metadata("./obs-metadata.npy")
+            initial_reward_params = self.load_metadata(metadata_file)
             self.state = initial_reward_params
             self.current_reward_params = {
             "Latency": self.state['caliper']['Latency'],
@@ -181,54 +208,55 @@ class AigisEnv(gym.Env):
         print("initial_reward:\t", self.initial_reward_params)
         print("Aigis init success!")
 
-    def _convert2sorteddf(self, data):
-        """
-        处理原始state信息，返回《固定排序》的DataFrame
-        """
-        tdf = pd.DataFrame.from_dict(data).fillna(0).astype("float")
-        tcols = sorted(list(tdf.columns))
-        return tdf[tcols]
-    
     def _handle_state(self, state):
         """
         26, 25, 29
         处理原始state信息，转换成二维obs[[orderer], [peer], [peer-net]]
+        列顺序由启动时生成的FeatureSchema固定, 中间结果写入预分配的数组
+        obs_source为window而窗口为空时沿用上一次的obs并置self.obs_stale
         """
-        _obs = []
-        for node_name in ("orderer", "peer", "peer-net"):
-            _obs.append(pd.DataFrame(self._convert2sorteddf(state['prom'][node_name]).mean()).T)
-        _onelinedf = pd.concat(_obs, axis=1).astype(float)
-        if self._obs_limits is  None:
+        self.obs_stale = False
+        if self._deriver is not None:
+            _vectors = self._deriver.derive(state)
+        elif self._obs_source == "window" and not state.get('window', {}).get('samples'):
+            # 窗口内没有样本时不能换用prom: 两者的列不同, 缺失列会被置0
+            if self._obs_limits is None:
+                raise RuntimeError("obs_source is window but the benchmark window has no samples")
+            print("[Env] WARNING: benchmark window has no samples, repeat the previous observation")
+            self.obs_stale = True
+            _vectors = [self._obs_values[self._obs_offsets[i]:self._obs_offsets[i + 1]].copy()
+                        for i in range(len(self._obs_offsets) - 1)]
+        else:
+            _source = state['window'] if self._obs_source == "window" else state['prom']
+            if self._schema is None:
+                self._schema = FeatureSchema(_source)
+            _vectors = self._schema.fill(_source)
+
+        if self._obs_limits is None:
+            _sizes = [len(v) for v in _vectors]
+            self._obs_offsets = np.cumsum([0] + _sizes)
+            self._obs_values = np.zeros(self._obs_offsets[-1])
+            self._obs_scaled = np.zeros(self._obs_offsets[-1])
+            for i, v in enumerate(_vectors):
+                self._obs_values[self._obs_offsets[i]:self._obs_offsets[i + 1]] = v
             # 设置obs的limit为初始值的5倍
-            self._obs_limits = _onelinedf * 5
+            self._obs_limits = self._obs_values * 5
+            # limit为0(即初始值为0)的列归一化后为1.0
+            self._obs_zero_limits = ~(self._obs_limits > 0)
         else:
-            # Align columns to match the initial observation shape (limits)
-            # This handles cases where Prometheus metrics might vary (missing or new columns)
-            _onelinedf = _onelinedf.reindex(columns=self._obs_limits.columns, fill_value=0.0)
-
-        # 此处fillna是为了防止除数为0，即最大值有可能是0
-        # _onelineres = (_onelinedf / self._obs_limits).fillna(1.0).clip(0, 1.0)
-        # _temp = (_onelinedf / self._obs_limits).fillna(1.0)
-        # Use numpy for safer clipping to avoid Pandas AssertionError
-        # _onelineres = pd.DataFrame(np.clip(_temp.values.astype(float), 0.0, 1.0), columns=_temp.columns)
-        
-        # Complete bypass of Pandas for arithmetic to avoid BlockManager errors
-        _vals = _onelinedf.values
-        _limits = self._obs_limits.values
-        # Avoid division by zero warnings if limits has 0
-        with np.errstate(divide='ignore', invalid='ignore'):
-            _temp_np = _vals / _limits
-        
-        _temp_np = np.nan_to_num(_temp_np, nan=1.0)
-        _onelineres_np = np.clip(_temp_np, 0.0, 1.0)
-        _onelineres = pd.DataFrame(_onelineres_np, columns=_onelinedf.columns)
-        # print(_onelineres.info())
-        _res = []
-        _sum = 0
-        for item in _obs: 
-            _res.append(np.squeeze(_onelineres.iloc[:, _sum: item.shape[1] + _sum].values, 0))
-            _sum += item.shape[1]
-        
+            for i, v in enumerate(_vectors):
+                self._obs_values[self._obs_offsets[i]:self._obs_offsets[i + 1]] = v
+
+        _scaled = self._obs_scaled
+        np.divide(self._obs_values, self._obs_limits, out=_scaled, where=~self._obs_zero_limits)
+        _scaled[self._obs_zero_limits] = 1.0
+        np.nan_to_num(_scaled, copy=False, nan=1.0)
+        np.clip(_scaled, 0.0, 1.0, out=_scaled)
+
+        # 返回副本, 预分配的数组在下一步会被覆盖
+        _res = [_scaled[self._obs_offsets[i]:self._obs_offsets[i + 1]].astype(np.float32)
+                for i in range(len(_vectors))]
+
         if self._obs_shape_dict is None:
             self._obs_shape_dict = {}
             self._obs_shape_dict["orderer"] = _res[0].shape
@@ -236,9 +264,7 @@ class AigisEnv(gym.Env):
             self._obs_shape_dict["peer-net"] = _res[2].shape
             print("set obs_shape_dict: {}, {}, {}".format(_res[0].shape, _res[1].shape, _res[2].shape))
 
-        return _onelineres.shape[1], _res
-
-
+        return int(self._obs_offsets[-1]), _res
 
     # load config
     def load_metadata(self, file):
@@ -348,7 +374,7 @@ class AigisEnv(gym.Env):
         return dict_data
 
     def _get_action_limits(self):
-        response = requests.request("GET", url + "/action/limits")
+        response = self._session.request("GET", self._url + "/action/limits")
         limits = json.loads(response.text)
         return limits
     
@@ -357,14 +383,19 @@ class AigisEnv(gym.Env):
             print("Set last_reward_params:\t", self.current_reward_params)
             self.last_reward_params = self.current_reward_params
 
-        response = requests.request("GET", url + "/metrics")
-        try:
-            state = json.loads(response.text)
-        except json.JSONDecodeError as e:
-            print(f"Error decoding JSON from {url}/metrics. Status Code: {response.status_code}")
-            print(f"Response text: {response.text}")
-            raise e
-            
+        if self._pending_state is not None:
+            # 任务结束时已随长轮询返回, 无需再请求/metrics
+            state = self._pending_state
+            self._pending_state = None
+        else:
+            response = self._session.request("GET", self._url + "/metrics")
+            try:
+                state = json.loads(response.text)
+            except json.JSONDecodeError as e:
+                print(f"Error decoding JSON from {self._url}/metrics. Status Code: {response.status_code}")
+                print(f"Response text: {response.text}")
+                raise e
+
         self.current_reward_params = {
             "Latency": state['caliper']['Latency'],
             "TPS": state['caliper']['TPS']
@@ -385,24 +416,29 @@ class AigisEnv(gym.Env):
     #         _res = 0
     #     return _res
     def _cal_delta_T(self, delta0, delta1, eta):
-        if delta1 > 0:
-            return np.exp(eta * delta0*delta1)
-        else:
-            return -np.exp(-eta*delta0*delta1)
+        # delta1 > 0: exp(eta*delta0*delta1), 否则: -exp(-eta*delta0*delta1)
+        # 用符号代替分支, 支持模拟器按batch计算reward
+        sign = np.where(delta1 > 0, 1.0, -1.0)
+        return sign * np.exp(sign * eta * delta0 * delta1)
     
     def _cal_delta_L(self, delta0, delta1, eta):
-        if delta1 > 0:
-            return -np.exp(eta*delta0*delta1)
-        else:
-            return np.exp(-eta*delta0*delta1)
+        # delta1 > 0: -exp(eta*delta0*delta1), 否则: exp(-eta*delta0*delta1)
+        sign = np.where(delta1 > 0, 1.0, -1.0)
+        return -sign * np.exp(sign * eta * delta0 * delta1)
 
 
-    def _cal_reward(self):
+    def _cal_reward(self, current=None, last=None):
+        """
+        params:
+        current, last: {"TPS", "Latency"}, 默认为本步和上一步的实测值(代理模型预测时传入预测值)
+        """
+        current = self.current_reward_params if current is None else current
+        last = self.last_reward_params if last is None else last
         r_T = 0
         r_L = 0
         # deltaT
-        deltaT_0 = (self.current_reward_params['TPS'] - self.initial_reward_params['TPS']) / self.initial_reward_params['TPS']
-        deltaT_1 = (self.current_reward_params['TPS'] - self.last_reward_params['TPS']) / self.last_reward_params['TPS']
+        deltaT_0 = (current['TPS'] - self.initial_reward_params['TPS']) / self.initial_reward_params['TPS']
+        deltaT_1 = (current['TPS'] - last['TPS']) / last['TPS']
         # if deltaT_0 > 0:
         #     r_T = (np.square((1 + deltaT_0)) -1) * abs(1 + deltaT_1)
         # else:
@@ -411,8 +447,8 @@ class AigisEnv(gym.Env):
         # r_T = self._cal_delta(deltaT_0, deltaT_1)
 
         # deltaL
-        deltaL_0 = -(self.current_reward_params['Latency'] - self.initial_reward_params['Latency']) / self.initial_reward_params['Latency']
-        deltaL_1 = -(self.current_reward_params['Latency'] - self.last_reward_params['Latency']) / self.last_reward_params['Latency']
+        deltaL_0 = -(current['Latency'] - self.initial_reward_params['Latency']) / self.initial_reward_params['Latency']
+        deltaL_1 = -(current['Latency'] - last['Latency']) / last['Latency']
         # if deltaL_0 > 0:
         #     r_L = (np.square((1 + deltaL_0)) -1) * abs(1 + deltaL_1)
         # else:
@@ -427,21 +463,55 @@ class AigisEnv(gym.Env):
         """
         使用默认参数先跑一次CDT获取状态信息，Reward等
         """
-        response = requests.request("POST", url + "/deploy/default")
-        print("__init_cdt:\t", response.text)
-        time.sleep(5)
-        while True:
-            scode = self._check_cdt_status()
-            if scode == 1:
-                # 重试 Retry
-                return False
-            elif scode == 0:
-                # 成功
-                break
-            time.sleep(3)
+        job_id = self._submit_cdt("POST", "/deploy/default")
+        if self._wait_cdt(job_id) != "done":
+            # 重试 Retry
+            return False
         print("Set default state successfully.")
         return True
 
+    def _submit_cdt(self, method, path, **kwargs):
+        """
+        提交CDT任务并返回job_id
+        任务队列满(429)时指数退避后重试, 其他错误直接抛出RuntimeError
+        """
+        backoff = 1
+        for _ in range(SUBMIT_RETRIES):
+            response = self._session.request(method, self._url + path, **kwargs)
+            if response.status_code == 200:
+                return response.json()["job_id"]
+            if response.status_code != 429:
+                raise RuntimeError("CDT {} {} failed, status code: {}, response: {}".format(
+                    method, path, response.status_code, response.text))
+            print("[Env] job queue of {} is full, retry in {}s".format(self._url, backoff))
+            time.sleep(backoff)
+            backoff = min(backoff * 2, SUBMIT_BACKOFF_MAX)
+        raise RuntimeError("CDT {} {} failed, job queue still full after {} retries".format(
+            method, path, SUBMIT_RETRIES))
+
+    def _wait_cdt(self, job_id):
+        """
+        长轮询等待任务结束，返回任务状态: done|failed
+        done时的metrics暂存到self._pending_state
+        任务不存在(404, 如控制器重启)时视为failed
+        """
+        while True:
+            response = self._session.request("GET", self._url + "/action/wait",
+                params={"job_id": job_id, "timeout": WAIT_TIMEOUT}, timeout=WAIT_TIMEOUT + 30)
+            if response.status_code == 404:
+                print("[Env] job {} not found on {}".format(job_id, self._url))
+                return "failed"
+            if response.status_code != 200:
+                raise RuntimeError("CDT wait for job {} failed, status code: {}, response: {}".format(
+                    job_id, response.status_code, response.text))
+            job = response.json()
+            if job["state"] in ("done", "failed"):
+                break
+        print("[Env] job {} {}, phases: {}".format(job_id, job["state"], job["phases"]))
+        if job["state"] == "done":
+            self._pending_state = job["metrics"]
+        return job["state"]
+
 
     def _deploy_cdt(self,config=None):
         """
@@ -465,48 +535,21 @@ class AigisEnv(gym.Env):
         }
         time_end = time.time()
         print("generate action time cost: {}s".format(time_end - time_start))
-        response = requests.request("POST", url + "/deploy/up", headers=headers, data=json.dumps(output_config_dict))
-        # print("deploy_result:\t" + response.text)
-        time.sleep(3)
-        # total_iteration = 0
-        while True:
-            scode = self._check_cdt_status()
-            if scode == 1:
-                # 重试
-                return False
-            elif scode == 0:
-                # 成功
-                break
-            time.sleep(3)
-            # total_iteration += 1
-        
+        job_id = self._submit_cdt("POST", "/deploy/up", headers=headers, data=json.dumps(output_config_dict))
+        if self._wait_cdt(job_id) != "done":
+            # 重试
+            return False
+
         return True
             # if(total_iteration % 10 == 0):
                 # print("[deploy-cdt-up] Wait for cdt benchmark result ...")
         # return True if response.text == "Good" else False
 
     def stop_cdt(self):
-        response = requests.request("DELETE", url + "/deploy/down")
-        # print(response.text)
-        time.sleep(1)
-        total_iteration = 0
-        while self._check_cdt_status():
-            time.sleep(1)
-            total_iteration += 1
-            # if(total_iteration % 10 == 0):
-                # print("[deploy-cdt-down] Wait for cdt stop ...")
+        self._wait_cdt(self._submit_cdt("DELETE", "/deploy/down"))
         # print("Done.")
         return True
 
-    
-    def _check_cdt_status(self):
-        response = requests.request("GET", url + "/action/status")
-        if response.text == "Not Found":
-            return -1
-        elif response.text == "Retry":
-            return 1
-        else:
-            return 0
 
     # def _normalization(self, state):
     #     # min-max 归一化
@@ -573,8 +616,28 @@ class AigisEnv(gym.Env):
         assert obs[2].shape == self._obs_shape_dict['peer-net']
         
         # print("[Env] obs: prom: {}".format(self.state['prom']))
-        return obs, [reward] * self.n, False, {}, self.state['caliper']['TPS'], self.state['caliper']['Latency']
+        # obs_stale: 本次obs不是由本次benchmark得到的, 不应作为真实transition
+        info = {"obs_stale": True} if nisRetry and self.obs_stale else {}
+        return obs, [reward] * self.n, False, info, self.state['caliper']['TPS'], self.state['caliper']['Latency']
+
 
+    def step_async(self, action):
+        """
+        在后台线程中执行step(部署、benchmark、收集), 立即返回
+        调用方可在benchmark期间训练, 之后通过step_wait获取结果
+        """
+        assert self._step_future is None, "step_wait must be called before the next step_async"
+        if self._step_executor is None:
+            self._step_executor = ThreadPoolExecutor(1)
+        self._step_future = self._step_executor.submit(self.step, action)
+
+    def step_wait(self):
+        """
+        阻塞直到step_async提交的step完成, 返回值同step
+        """
+        assert self._step_future is not None, "step_async must be called first"
+        future, self._step_future = self._step_future, None
+        return future.result()
 
     def reset(self):
         # 返回obs 状态信息list
@@ -583,6 +646,11 @@ class AigisEnv(gym.Env):
     def render(self, mode='human'):
         pass
     def close(self):
+        if self._step_future is not None:
+            self.step_wait()
+        if self._step_executor is not None:
+            self._step_executor.shutdown()
+            self._step_executor = None
         self.stop_cdt()
 
 
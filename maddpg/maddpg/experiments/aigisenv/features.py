@@ -0,0 +1,190 @@
+import re
+import numpy as np
+
+# 没有类型信息时, 按后缀判断单调递增的样本
+_COUNTER_SUFFIX = re.compile(r"^(.*?_(?:sum|count|total))(?=$|[_*])")
+_MONOTONIC = ("counter", "histogram", "summary")
+
+
+class FeatureSchema(object):
+    """
+    固定的特征索引: 每种节点的列名(metric名+label) -> 列位置, 启动时由第一次的state生成
+    之后每次抓取直接写入预分配的numpy数组并对各节点取均值
+    缺失的列为0, 新出现的列忽略, 保证obs的形状不变
+    """
+    NODE_TYPES = ("orderer", "peer", "peer-net")
+
+    def __init__(self, prom):
+        """
+        params:
+        prom: {node_type: [各节点的{列名: 值}]}
+        """
+        self.columns = {}
+        self.index = {}
+        self._rows = {}
+        self._values = {}
+        for node_type in self.NODE_TYPES:
+            columns = sorted({key for data in prom[node_type] for key in data})
+            self.columns[node_type] = columns
+            self.index[node_type] = {key: i for i, key in enumerate(columns)}
+            self._rows[node_type] = np.zeros((max(len(prom[node_type]), 1), len(columns)))
+            self._values[node_type] = np.zeros(len(columns))
+
+    @property
+    def sizes(self):
+        return [len(self.columns[node_type]) for node_type in self.NODE_TYPES]
+
+    def fill(self, prom):
+        """
+        return: [orderer, peer, peer-net]各节点均值, 数组在下一次fill时会被覆盖
+        """
+        res = []
+        for node_type in self.NODE_TYPES:
+            nodes = prom[node_type]
+            rows = self._rows[node_type]
+            if len(nodes) > rows.shape[0]:
+                # 节点数增加时才重新分配
+                rows = np.zeros((len(nodes), rows.shape[1]))
+                self._rows[node_type] = rows
+            values = self._values[node_type]
+            if not nodes:
+                values.fill(0.0)
+                res.append(values)
+                continue
+            used = rows[:len(nodes)]
+            used.fill(0.0)
+            index = self.index[node_type]
+            for row, data in enumerate(nodes):
+                for key in data:
+                    col = index.get(key)
+                    if col is not None and data[key] is not None:
+                        used[row, col] = data[key]
+            np.mean(used, axis=0, out=values)
+            res.append(values)
+        return res
+
+
+class FeatureDeriver(object):
+    """
+    将Prometheus原始值转换为平稳特征, 输出定长float32向量
+    counter -> 两次抓取之间的每秒速率, 跨benchmark(重新部署)时为本次benchmark内的速率
+    histogram/summary的_sum/_count -> 区间均值(delta_sum / delta_count)
+    gauge -> 原值
+    列集合在第一次调用时由FeatureSchema确定
+    """
+    NODE_TYPES = ("orderer", "peer", "peer-net")
+
+    def __init__(self):
+        self._schema = None
+        self._plans = None
+        self.names = None
+        self._last = None
+
+    def _split(self, key, types):
+        """
+        拆分列名为(样本名, label后缀), 返回(样本名, 后缀, 类型)
+        """
+        for name in sorted(types, key=len, reverse=True):
+            if key.startswith(name):
+                rest = key[len(name):]
+                if rest == "" or rest[0] in "_*":
+                    return name, rest, types[name]
+        match = _COUNTER_SUFFIX.match(key)
+        if match is not None:
+            return match.group(1), key[match.end(1):], "counter"
+        return key, "", "gauge"
+
+    def _plan(self, columns, index, types):
+        """
+        为一种节点生成派生计划
+        """
+        gauges, rates, sums, counts = [], [], [], []
+        means = []
+        paired = set()
+        for key in columns:
+            name, suffix, kind = self._split(key, types)
+            if kind in _MONOTONIC and name.endswith("_sum"):
+                base = name[:-len("_sum")]
+                count_key = base + "_count" + suffix
+                if count_key in index:
+                    sums.append(index[key])
+                    counts.append(index[count_key])
+                    means.append(base + "_mean" + suffix)
+                    paired.update((key, count_key))
+        for key in columns:
+            if key in paired:
+                continue
+            if self._split(key, types)[2] in _MONOTONIC:
+                rates.append(index[key])
+            else:
+                gauges.append(index[key])
+        names = [columns[i] for i in gauges] + [columns[i] + "_rate" for i in rates] + means
+        plan = {
+            "gauges": np.array(gauges, dtype=np.int64),
+            "rates": np.array(rates, dtype=np.int64),
+            "sums": np.array(sums, dtype=np.int64),
+            "counts": np.array(counts, dtype=np.int64)
+        }
+        return plan, names
+
+    def derive(self, state):
+        """
+        params:
+        state: /cdt/metrics的返回值, 使用prom, types, timestamp, since
+        return: [orderer, peer, peer-net]三个float32向量
+        """
+        prom = state['prom']
+        if self._schema is None:
+            types = state.get('types') or {}
+            self._schema = FeatureSchema(prom)
+            self._plans = {}
+            self.names = {}
+            for node_type in self.NODE_TYPES:
+                self._plans[node_type], self.names[node_type] = self._plan(
+                    self._schema.columns[node_type], self._schema.index[node_type], types)
+
+        timestamp = state.get('timestamp')
+        since = state.get('since')
+        current = dict(zip(self.NODE_TYPES, [values.copy() for values in self._schema.fill(prom)]))
+
+        # 计算速率的区间: 同一次benchmark内从上次抓取开始
+        # 上次抓取早于本次benchmark开始时, 中间经过了重新部署, 容器重启后计数器从0开始,
+        # 即使当前值超过上次的值也不能相减, 直接以本次值为增量、以since为起点
+        if self._last is not None and timestamp is not None and (since is None or since <= self._last[0]):
+            start = self._last[0]
+            previous = self._last[1]
+        else:
+            start = since
+            previous = None
+        elapsed = timestamp - start if timestamp is not None and start is not None else 0.0
+
+        res = []
+        for node_type in self.NODE_TYPES:
+            plan = self._plans[node_type]
+            values = current[node_type]
+            if previous is None:
+                delta = values.copy()
+            else:
+                delta = values - previous[node_type]
+                # 计数器重置(节点重启)时, 本次值即为增量
+                reset = delta < 0
+                delta[reset] = values[reset]
+
+            if elapsed > 0:
+                rates = delta[plan["rates"]] / elapsed
+            else:
+                rates = np.zeros(len(plan["rates"]))
+
+            d_sum, d_count = delta[plan["sums"]], delta[plan["counts"]]
+            # 区间内没有新的观测时退化为累计均值
+            c_sum, c_count = values[plan["sums"]], values[plan["counts"]]
+            d_sum = np.where(d_count > 0, d_sum, c_sum)
+            d_count = np.where(d_count > 0, d_count, c_count)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                means = np.where(d_count > 0, d_sum / d_count, 0.0)
+
+            res.append(np.concatenate([values[plan["gauges"]], rates, means]).astype(np.float32))
+
+        if timestamp is not None:
+            self._last = (timestamp, current)
+        return res
@@ -0,0 +1,141 @@
+import numpy as np
+
+
+class RandomFeatureRegressor(object):
+    """
+    随机傅里叶特征(近似RBF核) + 岭回归, 训练和预测都只有矩阵乘法, 可按batch预测上千个样本
+    params:
+    num_features: 随机特征维数
+    ridge: L2正则系数
+    lengthscale: RBF核宽度, 为None时取样本两两距离的中位数
+    """
+
+    def __init__(self, num_features=256, ridge=1e-2, lengthscale=None, seed=0):
+        self._num_features = num_features
+        self._ridge = ridge
+        self._lengthscale = lengthscale
+        self._rng = np.random.RandomState(seed)
+        self._coef = None
+
+    def _transform(self, X):
+        return np.sqrt(2.0 / self._num_features) * np.cos(X.dot(self._W) + self._b)
+
+    def fit(self, X, Y):
+        X = np.asarray(X, dtype=np.float64)
+        Y = np.asarray(Y, dtype=np.float64)
+        if self._lengthscale is None:
+            sq = np.maximum(np.sum(X ** 2, 1)[:, None] + np.sum(X ** 2, 1)[None, :] - 2 * X.dot(X.T), 0.0)
+            dist = np.sqrt(sq[np.triu_indices(len(X), 1)])
+            median = np.median(dist) if len(dist) else 0.0
+            lengthscale = median if median > 0 else 1.0
+        else:
+            lengthscale = self._lengthscale
+        self._W = self._rng.normal(0.0, 1.0 / lengthscale, (X.shape[1], self._num_features))
+        self._b = self._rng.uniform(0.0, 2 * np.pi, self._num_features)
+        self._mean = Y.mean(0)
+        self._std = Y.std(0) + 1e-8
+        Phi = self._transform(X)
+        A = Phi.T.dot(Phi) + self._ridge * np.eye(self._num_features)
+        self._coef = np.linalg.solve(A, Phi.T.dot((Y - self._mean) / self._std))
+        return self
+
+    def predict(self, X):
+        return self._transform(np.asarray(X, dtype=np.float64)).dot(self._coef) * self._std + self._mean
+
+
+class AigisSimulator(object):
+    """
+    AigisEnv的学习型孪生环境(Dyna): 用真实step的历史拟合
+    (obs, action) -> (next obs, log TPS, log Latency), reward按env的公式由预测值计算
+    augment从真实出现过的obs出发按当前策略批量rollout, 合成的transition写入各agent的replay buffer
+    params:
+    env: AigisEnv, 提供obs切分、初始reward参数和reward公式
+    min_history: 真实样本数达到该值后才生成合成数据
+    """
+
+    def __init__(self, env, min_history=10, num_features=256, ridge=1e-2, seed=0):
+        self._env = env
+        self._min_history = min_history
+        self._model = RandomFeatureRegressor(num_features=num_features, ridge=ridge, seed=seed)
+        self._rng = np.random.RandomState(seed)
+        self._X = []
+        self._Y = []
+        # rollout的起点: (obs_n, TPS, Latency)
+        self._starts = []
+        self._obs_sizes = None
+        self._fitted = False
+
+    @property
+    def ready(self):
+        return self._fitted
+
+    def _concat(self, arrays):
+        return np.concatenate([np.asarray(a, dtype=np.float64).ravel() for a in arrays])
+
+    def add(self, obs_n, action_n, new_obs_n, tps, latency):
+        """
+        加入一次真实step
+        """
+        if self._obs_sizes is None:
+            self._obs_sizes = [np.asarray(o).size for o in obs_n]
+            initial = self._env.initial_reward_params
+            self._starts.append(([np.asarray(o) for o in obs_n], initial['TPS'], initial['Latency']))
+        self._X.append(np.concatenate([self._concat(obs_n), self._concat(action_n)]))
+        self._Y.append(np.concatenate([self._concat(new_obs_n),
+                                       [np.log(max(tps, 1e-6)), np.log(max(latency, 1e-6))]]))
+        self._starts.append(([np.asarray(o) for o in new_obs_n], tps, latency))
+
+    def fit(self):
+        if len(self._X) < self._min_history:
+            return False
+        self._model.fit(np.array(self._X), np.array(self._Y))
+        self._fitted = True
+        return True
+
+    def _split(self, obs):
+        return np.split(obs, np.cumsum(self._obs_sizes)[:-1], axis=1)
+
+    def predict(self, obs_n, act_n):
+        """
+        obs_n, act_n: 每个agent一个[batch, dim]数组
+        return: (next obs_n, TPS[batch], Latency[batch])
+        """
+        X = np.concatenate(list(obs_n) + list(act_n), axis=1)
+        Y = self._model.predict(X)
+        split = sum(self._obs_sizes)
+        next_obs = np.clip(Y[:, :split], 0.0, 1.0)
+        return self._split(next_obs), np.exp(Y[:, split]), np.exp(Y[:, split + 1])
+
+    def rollout(self, trainers, batch_size, horizon=1, act_min=0.0, act_max=1.0):
+        """
+        从随机选取的真实obs出发, 用各agent的策略批量rollout horizon步
+        return: [(obs_n, act_n, rew[batch], new_obs_n)], 每步一个
+        """
+        starts = [self._starts[i] for i in self._rng.randint(0, len(self._starts), batch_size)]
+        obs_n = [np.stack([s[0][i] for s in starts]).astype(np.float64) for i in range(len(self._obs_sizes))]
+        last = {"TPS": np.array([s[1] for s in starts]), "Latency": np.array([s[2] for s in starts])}
+        res = []
+        for _ in range(horizon):
+            act_n = [np.clip(agent.act(obs), act_min, act_max) for agent, obs in zip(trainers, obs_n)]
+            new_obs_n, tps, latency = self.predict(obs_n, act_n)
+            current = {"TPS": tps, "Latency": latency}
+            rew = self._env._cal_reward(current=current, last=last)
+            res.append((obs_n, act_n, rew, new_obs_n))
+            obs_n, last = new_obs_n, current
+        return res
+
+    def augment(self, trainers, num_samples, horizon=1, act_min=0.0, act_max=1.0):
+        """
+        生成num_samples个合成transition写入所有agent的replay buffer(各agent下标保持一致)
+        return: 写入的transition数
+        """
+        if not self._fitted or num_samples <= 0:
+            return 0
+        count = 0
+        batch_size = max(num_samples // horizon, 1)
+        for obs_n, act_n, rew, new_obs_n in self.rollout(trainers, batch_size, horizon, act_min, act_max):
+            done = np.zeros(len(rew))
+            for i, agent in enumerate(trainers):
+                agent.experience_batch(obs_n[i], act_n[i], rew, new_obs_n[i], done)
+            count += len(rew)
+        return count
@@ -0,0 +1,189 @@
+import numpy as np
+
+
+class GPRegressor(object):
+    """
+    RBF核的高斯过程回归(numpy实现), 每次fit在全部历史上重新求解
+    历史只有数百个点, Cholesky分解的开销可以忽略
+    params:
+    lengthscale: RBF核宽度, 为None时取样本两两距离的中位数
+    noise: 标准化后目标值的观测噪声方差
+    """
+
+    def __init__(self, lengthscale=None, noise=1e-2):
+        self._lengthscale = lengthscale
+        self._noise = noise
+        self._X = None
+
+    @staticmethod
+    def _sqdist(A, B):
+        return np.maximum(np.sum(A ** 2, 1)[:, None] + np.sum(B ** 2, 1)[None, :] - 2 * A.dot(B.T), 0.0)
+
+    def _kernel(self, A, B):
+        return np.exp(-0.5 * self._sqdist(A, B) / self._ls ** 2)
+
+    def fit(self, X, Y):
+        """
+        X: [n, d], Y: [n, k], k个目标共用一个核
+        """
+        X = np.asarray(X, dtype=np.float64)
+        Y = np.asarray(Y, dtype=np.float64)
+        self._mean = Y.mean(0)
+        self._std = Y.std(0) + 1e-8
+        if self._lengthscale is None:
+            dist = np.sqrt(self._sqdist(X, X)[np.triu_indices(len(X), 1)])
+            median = np.median(dist) if len(dist) else 0.0
+            self._ls = median if median > 0 else 1.0
+        else:
+            self._ls = self._lengthscale
+        K = self._kernel(X, X) + self._noise * np.eye(len(X))
+        self._L = np.linalg.cholesky(K)
+        self._alpha = np.linalg.solve(self._L.T, np.linalg.solve(self._L, (Y - self._mean) / self._std))
+        self._X = X
+        return self
+
+    def predict(self, X):
+        """
+        return: (均值[m, k], 标准差[m, k])
+        """
+        X = np.asarray(X, dtype=np.float64)
+        Ks = self._kernel(X, self._X)
+        mean = Ks.dot(self._alpha)
+        v = np.linalg.solve(self._L, Ks.T)
+        var = np.maximum(1.0 - np.sum(v ** 2, 0), 1e-12)
+        std = np.sqrt(var)[:, None]
+        return mean * self._std + self._mean, std * self._std
+
+
+class SurrogateAigisEnv(object):
+    """
+    代理模型包装器: 用历史(action, TPS, Latency)训练GP, 在部署前预测候选action的性能
+    - 乐观估计(均值+kappa*标准差)仍低于历史得分skip_quantile分位的action不部署,
+      直接返回上一次的obs和预测reward
+    - rank对一批候选action按乐观估计排序, 只把最有希望的action交给真实环境
+    其余属性和方法转发给被包装的AigisEnv
+    params:
+    env: AigisEnv
+    min_history: 历史样本数达到该值后才开始预测
+    max_history: 只用最近的样本训练
+    kappa: 乐观估计中标准差的系数
+    skip_quantile: 低于该分位的action被跳过, 为0时不跳过
+    max_skips: 连续跳过的最大次数, 之后必须执行一次真实benchmark
+    """
+
+    def __init__(self, env, min_history=20, max_history=500, kappa=1.0, skip_quantile=0.25, max_skips=3):
+        self.env = env
+        self._min_history = min_history
+        self._max_history = max_history
+        self._kappa = kappa
+        self._skip_quantile = skip_quantile
+        self._max_skips = max_skips
+        self._X = []
+        self._Y = []
+        self._model = None
+        self._skips = 0
+        self._last_obs = None
+        self._pending = None
+
+    def __getattr__(self, name):
+        # 只在常规属性查找失败时调用, env尚未设置(如unpickle)时不能再访问self.env, 否则无限递归
+        env = self.__dict__.get("env")
+        if env is None:
+            raise AttributeError(name)
+        return getattr(env, name)
+
+    def _features(self, action):
+        return np.concatenate([np.asarray(a, dtype=np.float64).ravel() for a in action])
+
+    def _score(self, tps, latency):
+        """
+        相对初始配置的得分, 权重与reward一致
+        """
+        initial = self.env.initial_reward_params
+        return self.env.c_T * tps / initial['TPS'] - self.env.c_L * latency / initial['Latency']
+
+    @property
+    def ready(self):
+        return self._model is not None
+
+    def record(self, action, tps, latency):
+        """
+        加入一次真实benchmark的结果并重新训练
+        """
+        self._X.append(self._features(action))
+        # 预测log值, 保证TPS/Latency为正
+        self._Y.append([np.log(max(tps, 1e-6)), np.log(max(latency, 1e-6))])
+        self._X = self._X[-self._max_history:]
+        self._Y = self._Y[-self._max_history:]
+        if len(self._X) >= self._min_history:
+            self._model = GPRegressor().fit(np.array(self._X), np.array(self._Y))
+
+    def predict(self, actions):
+        """
+        return: (TPS均值, Latency均值, 乐观得分), 各为[m]
+        """
+        mean, std = self._model.predict(np.array([self._features(a) for a in actions]))
+        tps, latency = np.exp(mean[:, 0]), np.exp(mean[:, 1])
+        optimistic = self._score(np.exp(mean[:, 0] + self._kappa * std[:, 0]),
+                                 np.exp(mean[:, 1] - self._kappa * std[:, 1]))
+        return tps, latency, optimistic
+
+    def rank(self, actions):
+        """
+        返回候选action的下标, 按乐观得分从高到低; 模型未就绪时保持原顺序
+        """
+        if not self.ready:
+            return list(range(len(actions)))
+        _, _, optimistic = self.predict(actions)
+        return list(np.argsort(-optimistic, kind="stable"))
+
+    def _threshold(self):
+        scores = [self._score(np.exp(y[0]), np.exp(y[1])) for y in self._Y]
+        return np.quantile(scores, self._skip_quantile)
+
+    def _screen(self, action):
+        """
+        action明显较差时返回跳过的step结果, 否则返回None
+        """
+        if not self.ready or self._skip_quantile <= 0 or self._skips >= self._max_skips \
+                or self._last_obs is None:
+            return None
+        tps, latency, optimistic = self.predict([action])
+        if optimistic[0] >= self._threshold():
+            return None
+        self._skips += 1
+        predicted = {"TPS": float(tps[0]), "Latency": float(latency[0])}
+        reward = self.env._cal_reward(current=predicted)
+        print("[Surrogate] skip action, predicted tps: {:.2f}, latency: {:.2f}, reward: {:.4f}".format(
+            predicted['TPS'], predicted['Latency'], reward))
+        info = {"surrogate": True, "predicted": predicted}
+        return self._last_obs, [reward] * self.env.n, False, info, predicted['TPS'], predicted['Latency']
+
+    def _finish(self, action, result):
+        self._skips = 0
+        self._last_obs = result[0]
+        self.record(action, result[4], result[5])
+        return result
+
+    def reset(self):
+        self._last_obs = self.env.reset()
+        return self._last_obs
+
+    def step(self, action, with_stop=True):
+        skipped = self._screen(action)
+        if skipped is not None:
+            return skipped
+        return self._finish(action, self.env.step(action, with_stop))
+
+    def step_async(self, action):
+        skipped = self._screen(action)
+        self._pending = (action, skipped)
+        if skipped is None:
+            self.env.step_async(action)
+
+    def step_wait(self):
+        action, skipped = self._pending
+        self._pending = None
+        if skipped is not None:
+            return skipped
+        return self._finish(action, self.env.step_wait())
@@ -0,0 +1,75 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .env import AigisEnv
+
+
+class VecAigisEnv(object):
+    """
+    多集群环境: 每个CDT控制器部署一组主机(config.yaml中caliper-eval的group),
+    一批action同时分发到各集群, 按完成顺序收集结果
+    obs/action空间与AigisEnv相同, 各集群必须一致
+    """
+
+    def __init__(self, urls, booted=True, **kwargs):
+        """
+        params:
+        urls: 各集群CDT控制器的地址, 如["http://10.0.0.1:5000/cdt", "http://10.0.0.2:5001/cdt"]
+        booted, kwargs: 传给每个AigisEnv, 初始state按集群分别保存在obs-metadata-<i>.npy
+        """
+        self.num_envs = len(urls)
+        self._executor = ThreadPoolExecutor(self.num_envs)
+        # 并发初始化, booted为False时每个集群都要执行一次benchmark
+        futures = [self._executor.submit(AigisEnv, booted=booted, url=env_url,
+                                         metadata_file="./obs-metadata-%d.npy" % i, **kwargs)
+                   for i, env_url in enumerate(urls)]
+        self.envs = [future.result() for future in futures]
+        self._futures = None
+
+        self.n = self.envs[0].n
+        self.action_space = self.envs[0].action_space
+        self.observation_space = self.envs[0].observation_space
+        for env in self.envs[1:]:
+            assert env.observation_space == self.observation_space, \
+                "observation shape mismatch between clusters: {} vs {}".format(
+                    env.observation_space, self.observation_space)
+
+    def reset(self):
+        return [env.reset() for env in self.envs]
+
+    def step_async(self, actions):
+        """
+        actions: 每个集群一组action, 长度为num_envs
+        """
+        assert self._futures is None, "results of the previous step_async are not collected"
+        assert len(actions) == self.num_envs
+        self._futures = {self._executor.submit(env.step, action): i
+                         for i, (env, action) in enumerate(zip(self.envs, actions))}
+
+    def step_completed(self):
+        """
+        按完成顺序返回(集群序号, step结果)
+        """
+        assert self._futures is not None, "step_async must be called first"
+        futures, self._futures = self._futures, None
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+    def step_wait(self):
+        """
+        阻塞直到所有集群完成, 按集群顺序返回step结果
+        """
+        res = [None] * self.num_envs
+        for i, result in self.step_completed():
+            res[i] = result
+        return res
+
+    def step(self, actions):
+        self.step_async(actions)
+        return self.step_wait()
+
+    def close(self):
+        if self._futures is not None:
+            self.step_wait()
+        self._executor.shutdown()
+        for env in self.envs:
+            env.close()
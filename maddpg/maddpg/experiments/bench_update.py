@@ -0,0 +1,106 @@
+import argparse
+import time
+import numpy as np
+import tensorflow.compat.v1 as tf
+tf.disable_v2_behavior()
+from gym import spaces
+
+import maddpg.common.tf_util as U
+from maddpg.trainer.maddpg import MADDPGAgentTrainer, FusedMADDPGTrainer
+
+
+def parse_args():
+    parser = argparse.ArgumentParser("Update throughput of MADDPG versus TensorFlow thread count")
+    # Thread configurations, one run per --num-cpu value
+    parser.add_argument("--num-cpu", type=str, default="1,2,4,0", help="comma separated thread pool sizes, 0 uses all cores")
+    parser.add_argument("--intra-op-threads", type=int, default=None, help="intra-op thread pool size, overrides --num-cpu")
+    parser.add_argument("--inter-op-threads", type=int, default=None, help="inter-op thread pool size, overrides --num-cpu")
+    parser.add_argument("--xla", action="store_true", default=False, help="enable XLA JIT compilation of the graph")
+    # Problem size, defaults follow the orderer/peer/peer-net agents of AigisEnv
+    parser.add_argument("--obs-dims", type=str, default="64,128,64", help="comma separated observation size of each agent")
+    parser.add_argument("--act-dims", type=str, default="10,30,13", help="comma separated action size of each agent")
+    parser.add_argument("--batch-size", type=int, default=1024, help="number of episodes to optimize at the same time")
+    parser.add_argument("--num-units", type=int, default=64, help="number of units in the mlp")
+    parser.add_argument("--max-episode-len", type=int, default=25, help="maximum episode length")
+    parser.add_argument("--lr", type=float, default=1e-2, help="learning rate for Adam optimizer")
+    parser.add_argument("--gamma", type=float, default=0.95, help="discount factor")
+    parser.add_argument("--tau", type=float, default=1e-2, help="soft target update rate")
+    parser.add_argument("--target-update-interval", type=int, default=1, help="training iterations between soft target updates")
+    parser.add_argument("--good-policy", type=str, default="maddpg", help="policy for good agents")
+    parser.add_argument("--fused-update", action="store_true", default=False, help="update all agents with a single session.run per iteration")
+    # Measurement
+    parser.add_argument("--warmup", type=int, default=5, help="untimed updates before measuring")
+    parser.add_argument("--iters", type=int, default=100, help="timed updates per configuration")
+    return parser.parse_args()
+
+def mlp_model(input, num_outputs, scope, reuse=False, num_units=64, rnn_cell=None):
+    # This model takes as input an observation and returns values of all actions
+    with tf.variable_scope(scope, reuse=reuse):
+        out = input
+        out = tf.layers.dense(out, units=num_units, activation=tf.nn.relu)
+        out = tf.layers.dense(out, units=num_units, activation=tf.nn.relu)
+        out = tf.layers.dense(out, units=num_outputs, activation=None)
+        return out
+
+def build_trainers(arglist, obs_dims, act_dims):
+    obs_shape_n = [(d,) for d in obs_dims]
+    act_space_n = [spaces.Box(low=0.0, high=1.0, shape=(d,), dtype=np.float32) for d in act_dims]
+    trainers = [MADDPGAgentTrainer("agent_%d" % i, mlp_model, obs_shape_n, act_space_n, i, arglist,
+                                   local_q_func=(arglist.good_policy == 'ddpg'))
+                for i in range(len(obs_dims))]
+    fused = FusedMADDPGTrainer(trainers, arglist) if arglist.fused_update else None
+    return trainers, fused
+
+def fill_buffers(trainers, obs_dims, act_dims, size):
+    # buffers are filled in lockstep so that sampled indexes line up across agents
+    rew = np.random.randn(size).astype(np.float32)
+    done = np.zeros(size, dtype=np.float32)
+    for agent, obs_dim, act_dim in zip(trainers, obs_dims, act_dims):
+        obs = np.random.rand(size, obs_dim).astype(np.float32)
+        obs_next = np.random.rand(size, obs_dim).astype(np.float32)
+        act = np.random.rand(size, act_dim).astype(np.float32)
+        agent.experience_batch(obs, act, rew, obs_next, done)
+
+def run_updates(trainers, fused, n):
+    for _ in range(n):
+        # t=0 passes the "update every 100 steps" check of the trainers
+        if fused is not None:
+            fused.update(0)
+        else:
+            for agent in trainers:
+                agent.preupdate()
+            for agent in trainers:
+                agent.update(trainers, 0)
+
+def bench(arglist, num_cpu, obs_dims, act_dims):
+    """Returns seconds per update of all agents with the given thread pool size."""
+    U.ALREADY_INITIALIZED.clear()
+    with tf.Graph().as_default():
+        with U.make_session(num_cpu, intra_op_threads=arglist.intra_op_threads,
+                            inter_op_threads=arglist.inter_op_threads, xla=arglist.xla):
+            trainers, fused = build_trainers(arglist, obs_dims, act_dims)
+            U.initialize()
+            fill_buffers(trainers, obs_dims, act_dims, trainers[0].max_replay_buffer_len)
+            run_updates(trainers, fused, arglist.warmup)
+            start = time.time()
+            run_updates(trainers, fused, arglist.iters)
+            return (time.time() - start) / arglist.iters
+
+def main(arglist):
+    obs_dims = [int(d) for d in arglist.obs_dims.split(",")]
+    act_dims = [int(d) for d in arglist.act_dims.split(",")]
+    assert len(obs_dims) == len(act_dims), "--obs-dims and --act-dims need one entry per agent"
+    print("agents: {}, batch size: {}, xla: {}, fused: {}".format(
+        len(obs_dims), arglist.batch_size, arglist.xla, arglist.fused_update))
+    print("{:>8} {:>12} {:>12} {:>10}".format("num_cpu", "ms/update", "updates/s", "speedup"))
+    base = None
+    for num_cpu in [int(n) for n in arglist.num_cpu.split(",")]:
+        seconds = bench(arglist, num_cpu, obs_dims, act_dims)
+        if base is None:
+            base = seconds
+        print("{:>8} {:>12.2f} {:>12.1f} {:>9.2f}x".format(
+            num_cpu if num_cpu > 0 else "all", seconds * 1000, 1.0 / seconds, base / seconds))
+
+if __name__ == '__main__':
+    arglist = parse_args()
+    main(arglist)
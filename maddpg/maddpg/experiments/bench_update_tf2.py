@@ -0,0 +1,112 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+import tensorflow as tf
+from gym import spaces
+
+# 不能导入maddpg.common.tf_util / maddpg.trainer.maddpg, 它们会在导入时关闭TF2行为
+from maddpg.trainer.maddpg_tf2 import MADDPGAgentTrainerTF2, MLP
+
+
+def parse_args():
+    parser = argparse.ArgumentParser("Update throughput of the TF2 MADDPG trainer, eager versus tf.function")
+    # Threads are fixed for the whole process, run once per thread count
+    parser.add_argument("--num-cpu", type=int, default=1, help="threads per TF thread pool, 0 uses all cores")
+    parser.add_argument("--xla", action="store_true", default=False, help="XLA compile the train steps")
+    parser.add_argument("--compare-tf1", action="store_true", default=False, help="also run bench_update.py with the same settings in a separate process")
+    # Problem size, defaults follow the orderer/peer/peer-net agents of AigisEnv
+    parser.add_argument("--obs-dims", type=str, default="64,128,64", help="comma separated observation size of each agent")
+    parser.add_argument("--act-dims", type=str, default="10,30,13", help="comma separated action size of each agent")
+    parser.add_argument("--batch-size", type=int, default=1024, help="number of episodes to optimize at the same time")
+    parser.add_argument("--num-units", type=int, default=64, help="number of units in the mlp")
+    parser.add_argument("--max-episode-len", type=int, default=25, help="maximum episode length")
+    parser.add_argument("--lr", type=float, default=1e-2, help="learning rate for Adam optimizer")
+    parser.add_argument("--gamma", type=float, default=0.95, help="discount factor")
+    parser.add_argument("--tau", type=float, default=1e-2, help="soft target update rate")
+    parser.add_argument("--target-update-interval", type=int, default=1, help="training iterations between soft target updates")
+    parser.add_argument("--good-policy", type=str, default="maddpg", help="policy for good agents")
+    # Measurement
+    parser.add_argument("--warmup", type=int, default=5, help="untimed updates before measuring, includes tracing")
+    parser.add_argument("--iters", type=int, default=100, help="timed updates per configuration")
+    return parser.parse_args()
+
+def build_trainers(arglist, obs_dims, act_dims):
+    obs_shape_n = [(d,) for d in obs_dims]
+    act_space_n = [spaces.Box(low=0.0, high=1.0, shape=(d,), dtype=np.float32) for d in act_dims]
+    return [MADDPGAgentTrainerTF2("agent_%d" % i, MLP, obs_shape_n, act_space_n, i, arglist,
+                                  local_q_func=(arglist.good_policy == 'ddpg'))
+            for i in range(len(obs_dims))]
+
+def fill_buffers(trainers, obs_dims, act_dims, size):
+    # buffers are filled in lockstep so that sampled indexes line up across agents
+    rew = np.random.randn(size).astype(np.float32)
+    done = np.zeros(size, dtype=np.float32)
+    for agent, obs_dim, act_dim in zip(trainers, obs_dims, act_dims):
+        obs = np.random.rand(size, obs_dim).astype(np.float32)
+        obs_next = np.random.rand(size, obs_dim).astype(np.float32)
+        act = np.random.rand(size, act_dim).astype(np.float32)
+        agent.experience_batch(obs, act, rew, obs_next, done)
+
+def run_updates(trainers, n):
+    loss = None
+    for _ in range(n):
+        # t=0 passes the "update every 100 steps" check of the trainers
+        for agent in trainers:
+            agent.preupdate()
+        for agent in trainers:
+            loss = agent.update(trainers, 0)
+    return loss
+
+def bench(arglist, obs_dims, act_dims, eager):
+    """Returns seconds per update of all agents, with the train steps run eagerly or as tf.function."""
+    tf.config.run_functions_eagerly(eager)
+    try:
+        trainers = build_trainers(arglist, obs_dims, act_dims)
+        fill_buffers(trainers, obs_dims, act_dims, trainers[0].max_replay_buffer_len)
+        loss = run_updates(trainers, arglist.warmup)
+        assert loss is not None and np.all(np.isfinite(loss[:2])), "update did not run: {}".format(loss)
+        start = time.time()
+        run_updates(trainers, arglist.iters)
+        return (time.time() - start) / arglist.iters
+    finally:
+        tf.config.run_functions_eagerly(False)
+
+def bench_tf1(arglist):
+    """Runs bench_update.py in a child process, v1 graph mode cannot share a process with TF2 eager."""
+    cmd = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_update.py"),
+           "--num-cpu", str(arglist.num_cpu), "--obs-dims", arglist.obs_dims, "--act-dims", arglist.act_dims,
+           "--batch-size", str(arglist.batch_size), "--num-units", str(arglist.num_units),
+           "--max-episode-len", str(arglist.max_episode_len), "--lr", str(arglist.lr),
+           "--gamma", str(arglist.gamma), "--tau", str(arglist.tau),
+           "--target-update-interval", str(arglist.target_update_interval),
+           "--good-policy", arglist.good_policy,
+           "--warmup", str(arglist.warmup), "--iters", str(arglist.iters)]
+    if arglist.xla:
+        cmd.append("--xla")
+    output = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+    # last row: num_cpu, ms/update, updates/s, speedup
+    return float(output.strip().splitlines()[-1].split()[1]) / 1000
+
+def main(arglist):
+    obs_dims = [int(d) for d in arglist.obs_dims.split(",")]
+    act_dims = [int(d) for d in arglist.act_dims.split(",")]
+    assert len(obs_dims) == len(act_dims), "--obs-dims and --act-dims need one entry per agent"
+    tf.config.threading.set_intra_op_parallelism_threads(arglist.num_cpu)
+    tf.config.threading.set_inter_op_parallelism_threads(arglist.num_cpu)
+    print("agents: {}, batch size: {}, num_cpu: {}, xla: {}".format(
+        len(obs_dims), arglist.batch_size, arglist.num_cpu if arglist.num_cpu > 0 else "all", arglist.xla))
+    results = [("tf2 eager", bench(arglist, obs_dims, act_dims, eager=True)),
+               ("tf2 function", bench(arglist, obs_dims, act_dims, eager=False))]
+    if arglist.compare_tf1:
+        results.append(("tf1 graph", bench_tf1(arglist)))
+    print("{:>14} {:>12} {:>12} {:>10}".format("mode", "ms/update", "updates/s", "speedup"))
+    base = results[0][1]
+    for mode, seconds in results:
+        print("{:>14} {:>12.2f} {:>12.1f} {:>9.2f}x".format(mode, seconds * 1000, 1.0 / seconds, base / seconds))
+
+if __name__ == '__main__':
+    arglist = parse_args()
+    main(arglist)
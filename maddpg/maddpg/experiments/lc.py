@@ -1,48 +1,25 @@
 import argparse
-from os import access
-import numpy as np
 import tensorflow.compat.v1 as tf
 tf.disable_v2_behavior()
-import time
-import pickle
-import pymongo
-import datetime
 
 import maddpg.common.tf_util as U
-from maddpg.trainer.maddpg import MADDPGAgentTrainer
+from maddpg.trainer.maddpg import MADDPGAgentTrainer, FusedMADDPGTrainer, checkpoint_vars
 # import tensorflow.contrib.layers as layers
 
-import pdb
-# import sys
-# sys.path.append('/root/code/aigis/maddpg/maddpg/experiments')
-from  aigisenv import AigisEnv
+import training_loop
 
 def parse_args():
     parser = argparse.ArgumentParser("Reinforcement Learning experiments for multiagent environments")
-    # Environment
+    training_loop.add_args(parser)
     parser.add_argument("--scenario", type=str, default="simple", help="name of the scenario script")
-    parser.add_argument("--max-episode-len", type=int, default=25, help="maximum episode length")
-    parser.add_argument("--num-episodes", type=int, default=60000, help="number of episodes")
     parser.add_argument("--num-adversaries", type=int, default=0, help="number of adversaries")
-    parser.add_argument("--good-policy", type=str, default="maddpg", help="policy for good agents")
     parser.add_argument("--adv-policy", type=str, default="maddpg", help="policy of adversaries")
-    # Core training parameters
-    parser.add_argument("--lr", type=float, default=1e-2, help="learning rate for Adam optimizer")
-    parser.add_argument("--gamma", type=float, default=0.95, help="discount factor")
-    parser.add_argument("--batch-size", type=int, default=1024, help="number of episodes to optimize at the same time")
-    parser.add_argument("--num-units", type=int, default=64, help="number of units in the mlp")
-    # Checkpointing
-    parser.add_argument("--exp-name", type=str, default=None, help="name of the experiment")
     parser.add_argument("--save-dir", type=str, default="/tmp/policy/", help="directory in which training state and model should be saved")
-    parser.add_argument("--save-rate", type=int, default=1, help="save model once every time this many episodes are completed")
-    parser.add_argument("--load-dir", type=str, default="", help="directory in which training state and model are loaded")
-    # Evaluation
-    parser.add_argument("--restore", action="store_true", default=False)
+    parser.add_argument("--fused-update", action="store_true", default=False, help="update all agents with a single session.run per iteration")
     parser.add_argument("--display", action="store_true", default=False)
     parser.add_argument("--benchmark", action="store_true", default=False)
     parser.add_argument("--benchmark-iters", type=int, default=100000, help="number of iterations run for benchmarking")
     parser.add_argument("--benchmark-dir", type=str, default="./benchmark_files/", help="directory where benchmark data is saved")
-    parser.add_argument("--plots-dir", type=str, default="./learning_curves/", help="directory where plot data is saved")
     return parser.parse_args()
 
 def mlp_model(input, num_outputs, scope, reuse=False, num_units=64, rnn_cell=None):
@@ -66,125 +43,39 @@ def get_trainers_lc(env, obs_shape_n, arglist):
             local_q_func=(arglist.good_policy=='ddpg')))
     return trainers
 
-def train_lc(arglist):
-    print('train start...')
-    # myclient = pymongo.MongoClient("mongodb://localhost:27017/")
-    # mydb = myclient["aigis-maddpg"]
-    # mycol = mydb["train1107_smallbank_8peers"]
-    with U.single_threaded_session():
-        # Create environment
-        # env = make_env(arglist.scenario, arglist, arglist.benchmark)
-        env = AigisEnv(booted=False, act_importance=53)
-        # Create agent trainers
+def update_trainers(trainers, fused, t):
+    """
+    执行一次所有agent的更新, fused不为None时在一个session.run中完成
+    """
+    if fused is not None:
+        return fused.update(t)
+    loss = None
+    for agent in trainers:
+        agent.preupdate()
+    for agent in trainers:
+        loss = agent.update(trainers, t)
+    return loss
+
+def build_trainers(arglist):
+    """
+    返回training_loop使用的trainer工厂, 在TF1 session中创建网络并初始化变量
+    """
+    def build(env):
         obs_shape_n = [env.observation_space[i] for i in range(env.n)]
-        # num_adversaries = min(env.n, arglist.num_adversaries)
         trainers = get_trainers_lc(env, obs_shape_n, arglist)
+        fused = FusedMADDPGTrainer(trainers, arglist) if arglist.fused_update else None
         print('Using good policy {} and adv policy {}'.format(arglist.good_policy, arglist.adv_policy))
-
-        # Initialize
         U.initialize()
-
-        # Load previous results, if necessary
-        if arglist.load_dir == "":
-            arglist.load_dir = arglist.save_dir
-        if arglist.display or arglist.restore or arglist.benchmark:
-            print('Loading previous state...')
-            U.load_state(arglist.load_dir)
-
-        episode_rewards = [0.0]  # sum of rewards for all agents
-        agent_rewards = [[0.0] for _ in range(env.n)]  # individual agent reward
-        final_ep_rewards = []  # sum of rewards for training curve
-        final_ep_ag_rewards = []  # agent rewards for training curve
-        agent_info = [[[]]]  # placeholder for benchmarking info
-        saver = tf.train.Saver()
-        obs_n = env.reset()
-        episode_step = 0
-        train_step = 0
-        t_start = time.time()
-
-        ACT_MIN = 0.1
-        ACT_MAX = 1.0
-        ACT_STEP = 0.01
-        ACT_INIT = 0.51
-
-        print('Starting iterations...')
-        while True:
-            print("Train_step now: {}".format(train_step))
-            # get action
-            if ACT_INIT <= ACT_MIN:
-                ACT_INIT = ACT_MIN
-            else:
-                ACT_INIT -= ACT_STEP
-            action_n = [np.clip(agent.action(obs), ACT_INIT, ACT_MAX) for agent, obs in zip(trainers,obs_n)]
-            # environment step
-            new_obs_n, rew_n, done, info_n, tps, latency = env.step(action_n)
-            # debug
-            # pdb.set_trace()
-            # mycol.insert_one({"action": [i.tolist() for i in action_n], "next_obs": [i.tolist() for i in new_obs_n], 
-            #                 "reward": rew_n[0], "done": done, "info": info_n, "train_step": train_step,
-            #                 "tps": tps, "latency": latency,
-            #                 "date": datetime.datetime.now()}) 
-            episode_step += 1
-            # done = done_n
-            terminal = (episode_step >= arglist.max_episode_len)
-            # collect experience
-            for i, agent in enumerate(trainers):
-                agent.experience(obs_n[i], action_n[i], rew_n[i], new_obs_n[i], done, terminal)
-            obs_n = new_obs_n
-
-            for i, rew in enumerate(rew_n):
-                episode_rewards[-1] += rew
-                agent_rewards[i][-1] += rew
-
-            if done or terminal:
-                obs_n = env.reset()
-                episode_step = 0
-                episode_rewards.append(0)
-                for a in agent_rewards:
-                    a.append(0)
-                agent_info.append([[]])
-
-            # increment global step counter
-            train_step += 1
-
-
-
-            # update all trainers, if not in display or benchmark mode
-            loss = None
-            for agent in trainers:
-                agent.preupdate()
-            for agent in trainers:
-                loss = agent.update(trainers, train_step)
-
-            # save model, display training output
-            if terminal and (len(episode_rewards) % arglist.save_rate == 0):
-                U.save_state(arglist.save_dir, saver=saver)
-                # print statement depends on whether or not there are adversaries
-                # if num_adversaries == 0:
-                print("steps: {}, episodes: {}, mean episode reward: {}, time: {}".format(
-                    train_step, len(episode_rewards), np.mean(episode_rewards[-arglist.save_rate:]), round(time.time()-t_start, 3)))
-                # else:
-                #     print("steps: {}, episodes: {}, mean episode reward: {}, agent episode reward: {}, time: {}".format(
-                #         train_step, len(episode_rewards), np.mean(episode_rewards[-arglist.save_rate:]),
-                #         [np.mean(rew[-arglist.save_rate:]) for rew in agent_rewards], round(time.time()-t_start, 3)))
-                t_start = time.time()
-                # Keep track of final episode reward
-                final_ep_rewards.append(np.mean(episode_rewards[-arglist.save_rate:]))
-                for rew in agent_rewards:
-                    final_ep_ag_rewards.append(np.mean(rew[-arglist.save_rate:]))
-
-            # saves final episode reward for plotting training curve later
-            if len(episode_rewards) > arglist.num_episodes:
-                rew_file_name = arglist.plots_dir + arglist.exp_name + '_rewards.pkl'
-                with open(rew_file_name, 'wb') as fp:
-                    pickle.dump(final_ep_rewards, fp)
-                agrew_file_name = arglist.plots_dir + arglist.exp_name + '_agrewards.pkl'
-                with open(agrew_file_name, 'wb') as fp:
-                    pickle.dump(final_ep_ag_rewards, fp)
-                print('...Finished total of {} episodes.'.format(len(episode_rewards)))
-                break
+        # 只保存网络权重, 逐agent更新和fused更新的checkpoint可以互相加载
+        saver = tf.train.Saver(var_list=checkpoint_vars(trainers))
+        update = lambda t: update_trainers(trainers, fused, t)
+        save = lambda: U.save_state(arglist.save_dir, saver=saver)
+        load = lambda: U.load_state(arglist.load_dir, saver=saver)
+        return trainers, update, save, load
+    return build
 
 
 if __name__ == '__main__':
     arglist = parse_args()
-    train_lc(arglist)
+    arglist.restore = arglist.restore or arglist.display or arglist.benchmark
+    training_loop.train(arglist, build_trainers(arglist), session=U.session_from_args(arglist))
@@ -0,0 +1,57 @@
+import argparse
+import tensorflow as tf
+
+# 不能导入maddpg.common.tf_util / maddpg.trainer.maddpg, 它们会在导入时关闭TF2行为
+from maddpg.trainer.maddpg_tf2 import MADDPGAgentTrainerTF2, MLP, save_state, load_state
+
+import training_loop
+
+def parse_args():
+    parser = argparse.ArgumentParser("TF2 MADDPG training on the Aigis environment")
+    training_loop.add_args(parser)
+    parser.add_argument("--save-dir", type=str, default="/tmp/policy-tf2/", help="directory in which training state and model should be saved")
+    return parser.parse_args()
+
+def configure_threads(arglist):
+    """
+    设置TF线程池大小, 必须在执行任何op之前调用
+    """
+    intra = arglist.num_cpu if arglist.intra_op_threads is None else arglist.intra_op_threads
+    inter = arglist.num_cpu if arglist.inter_op_threads is None else arglist.inter_op_threads
+    tf.config.threading.set_intra_op_parallelism_threads(intra)
+    tf.config.threading.set_inter_op_parallelism_threads(inter)
+
+def get_trainers_lc(env, obs_shape_n, arglist):
+    trainers = []
+    for i in range(env.n):
+        trainers.append(MADDPGAgentTrainerTF2(
+            "agent_%d" % i, MLP, obs_shape_n, env.action_space, i, arglist,
+            local_q_func=(arglist.good_policy=='ddpg')))
+    return trainers
+
+def update_trainers(trainers, t):
+    loss = None
+    for agent in trainers:
+        agent.preupdate()
+    for agent in trainers:
+        loss = agent.update(trainers, t)
+    return loss
+
+def build_trainers(arglist):
+    """
+    返回training_loop使用的trainer工厂, 网络和优化器状态由tf.train.Checkpoint保存
+    """
+    def build(env):
+        obs_shape_n = [env.observation_space[i] for i in range(env.n)]
+        trainers = get_trainers_lc(env, obs_shape_n, arglist)
+        update = lambda t: update_trainers(trainers, t)
+        save = lambda: save_state(arglist.save_dir, trainers)
+        load = lambda: load_state(arglist.load_dir, trainers)
+        return trainers, update, save, load
+    return build
+
+if __name__ == '__main__':
+    arglist = parse_args()
+    print('using tf2 trainers')
+    configure_threads(arglist)
+    training_loop.train(arglist, build_trainers(arglist))
@@ -23,6 +23,11 @@ def parse_args():
     parser.add_argument("--gamma", type=float, default=0.95, help="discount factor")
     parser.add_argument("--batch-size", type=int, default=1024, help="number of episodes to optimize at the same time")
     parser.add_argument("--num-units", type=int, default=64, help="number of units in the mlp")
+    # Session
+    parser.add_argument("--num-cpu", type=int, default=1, help="threads per TF thread pool, 0 uses all cores")
+    parser.add_argument("--intra-op-threads", type=int, default=None, help="intra-op thread pool size, overrides --num-cpu")
+    parser.add_argument("--inter-op-threads", type=int, default=None, help="inter-op thread pool size, overrides --num-cpu")
+    parser.add_argument("--xla", action="store_true", default=False, help="enable XLA JIT compilation of the graph")
     # Checkpointing
     parser.add_argument("--exp-name", type=str, default=None, help="name of the experiment")
     parser.add_argument("--save-dir", type=str, default="/tmp/policy/", help="directory in which training state and model should be saved")
@@ -77,7 +82,7 @@ def get_trainers(env, num_adversaries, obs_shape_n, arglist):
 
 
 def train(arglist):
-    with U.single_threaded_session():
+    with U.session_from_args(arglist):
         # Create environment
         env = make_env(arglist.scenario, arglist, arglist.benchmark)
         # Create agent trainers
@@ -0,0 +1,261 @@
+import contextlib
+import time
+import pickle
+import numpy as np
+
+# 不导入tensorflow, lc.py(TF1 graph)和lc_tf2.py(TF2 eager)共用
+from  aigisenv import AigisEnv, VecAigisEnv, SurrogateAigisEnv, AigisSimulator
+
+ACT_MIN = 0.1
+ACT_MAX = 1.0
+ACT_STEP = 0.01
+ACT_INIT = 0.51
+
+
+def add_args(parser):
+    """
+    lc.py和lc_tf2.py共用的命令行参数
+    """
+    # Environment
+    parser.add_argument("--max-episode-len", type=int, default=25, help="maximum episode length")
+    parser.add_argument("--num-episodes", type=int, default=60000, help="number of episodes")
+    parser.add_argument("--good-policy", type=str, default="maddpg", help="policy for good agents")
+    parser.add_argument("--obs-source", type=str, default="prom", choices=["prom", "window"], help="observation from end-of-run scrape or benchmark window")
+    parser.add_argument("--derive-features", action="store_true", default=False, help="use counter rates and histogram means as observation")
+    # Core training parameters
+    parser.add_argument("--lr", type=float, default=1e-2, help="learning rate for Adam optimizer")
+    parser.add_argument("--gamma", type=float, default=0.95, help="discount factor")
+    parser.add_argument("--batch-size", type=int, default=1024, help="number of episodes to optimize at the same time")
+    parser.add_argument("--num-units", type=int, default=64, help="number of units in the mlp")
+    parser.add_argument("--tau", type=float, default=1e-2, help="soft target update rate")
+    parser.add_argument("--target-update-interval", type=int, default=1, help="training iterations between soft target updates")
+    # Session
+    parser.add_argument("--num-cpu", type=int, default=1, help="threads per TF thread pool, 0 uses all cores")
+    parser.add_argument("--intra-op-threads", type=int, default=None, help="intra-op thread pool size, overrides --num-cpu")
+    parser.add_argument("--inter-op-threads", type=int, default=None, help="inter-op thread pool size, overrides --num-cpu")
+    parser.add_argument("--xla", action="store_true", default=False, help="XLA compile the train steps")
+    # Checkpointing
+    parser.add_argument("--exp-name", type=str, default=None, help="name of the experiment")
+    parser.add_argument("--save-rate", type=int, default=1, help="save model once every time this many episodes are completed")
+    parser.add_argument("--load-dir", type=str, default="", help="directory in which training state and model are loaded")
+    parser.add_argument("--async-step", action="store_true", default=False, help="run updates and checkpointing while the benchmark is in flight")
+    parser.add_argument("--surrogate", action="store_true", default=False, help="skip actions the surrogate model predicts to be clearly bad")
+    parser.add_argument("--surrogate-candidates", type=int, default=1, help="number of perturbed actions ranked by the surrogate per step")
+    parser.add_argument("--model-rollouts", type=int, default=0, help="synthetic transitions generated by the learned simulator per real step")
+    parser.add_argument("--rollout-horizon", type=int, default=1, help="length of each simulated rollout")
+    parser.add_argument("--model-min-history", type=int, default=10, help="real steps required before the simulator is used")
+    parser.add_argument("--cdt-urls", type=str, default="", help="comma separated CDT controller urls, one per cluster, evaluated in parallel; not combinable with --surrogate, --model-rollouts or --async-step")
+    # Evaluation
+    parser.add_argument("--restore", action="store_true", default=False)
+    parser.add_argument("--plots-dir", type=str, default="./learning_curves/", help="directory where plot data is saved")
+    return parser
+
+def is_real(info_n):
+    """
+    代理模型跳过的step(预测reward)和obs过期的step不是真实transition, 不存入经验
+    """
+    return not (info_n.get("surrogate") or info_n.get("obs_stale"))
+
+def save_rewards(arglist, final_ep_rewards, final_ep_ag_rewards=None):
+    rew_file_name = arglist.plots_dir + arglist.exp_name + '_rewards.pkl'
+    with open(rew_file_name, 'wb') as fp:
+        pickle.dump(final_ep_rewards, fp)
+    if final_ep_ag_rewards is not None:
+        agrew_file_name = arglist.plots_dir + arglist.exp_name + '_agrewards.pkl'
+        with open(agrew_file_name, 'wb') as fp:
+            pickle.dump(final_ep_ag_rewards, fp)
+
+def train_lc(arglist, build, session=None):
+    """
+    单集群训练循环
+    params:
+    build: build(env) -> (trainers, update, save, load)
+        update(t): 更新所有agent, 返回最后一个agent的loss
+        save()/load(): 保存到arglist.save_dir/从arglist.load_dir加载
+    session: 包住整个训练过程的context manager, 如TF1的session
+    """
+    print('train start...')
+    with session or contextlib.nullcontext():
+        urls = arglist.cdt_urls.split(",") if arglist.cdt_urls else []
+        env_kwargs = {"url": urls[0]} if urls else {}
+        env = AigisEnv(booted=False, act_importance=53, obs_source=arglist.obs_source,
+            derive_features=arglist.derive_features, **env_kwargs)
+        if arglist.surrogate:
+            env = SurrogateAigisEnv(env)
+        simulator = AigisSimulator(env, min_history=arglist.model_min_history) if arglist.model_rollouts > 0 else None
+        t_build = time.time()
+        trainers, update, save, load = build(env)
+        print('trainers built in {:.3f}s'.format(time.time() - t_build))
+
+        # Load previous results, if necessary
+        if arglist.load_dir == "":
+            arglist.load_dir = arglist.save_dir
+        if arglist.restore:
+            print('Loading previous state...')
+            load()
+
+        episode_rewards = [0.0]  # sum of rewards for all agents
+        agent_rewards = [[0.0] for _ in range(env.n)]  # individual agent reward
+        final_ep_rewards = []  # sum of rewards for training curve
+        final_ep_ag_rewards = []  # agent rewards for training curve
+        obs_n = env.reset()
+        episode_step = 0
+        train_step = 0
+        t_start = time.time()
+        act_init = ACT_INIT
+        # async模式下延迟到下一次benchmark期间保存
+        save_pending = False
+
+        print('Starting iterations...')
+        while True:
+            print("Train_step now: {}".format(train_step))
+            # get action
+            act_init = max(act_init - ACT_STEP, ACT_MIN)
+            action_n = [np.clip(agent.action(obs), act_init, ACT_MAX) for agent, obs in zip(trainers, obs_n)]
+            if arglist.surrogate and arglist.surrogate_candidates > 1:
+                # 在策略输出附近采样候选action, 部署代理模型认为最好的一个
+                candidates = [action_n] + [[np.clip(a + np.random.normal(0, 0.1, a.shape), act_init, ACT_MAX)
+                    for a in action_n] for _ in range(arglist.surrogate_candidates - 1)]
+                action_n = candidates[env.rank(candidates)[0]]
+            # environment step
+            if arglist.async_step:
+                env.step_async(action_n)
+                # benchmark期间更新网络(不含本步经验)并保存模型
+                loss = update(train_step + 1)
+                if save_pending:
+                    save()
+                    save_pending = False
+                new_obs_n, rew_n, done, info_n, tps, latency = env.step_wait()
+            else:
+                new_obs_n, rew_n, done, info_n, tps, latency = env.step(action_n)
+            episode_step += 1
+            terminal = (episode_step >= arglist.max_episode_len)
+            # collect experience
+            real = is_real(info_n)
+            if real:
+                for i, agent in enumerate(trainers):
+                    agent.experience(obs_n[i], action_n[i], rew_n[i], new_obs_n[i], done, terminal)
+            # Dyna: 用真实step更新模拟器, 再生成合成transition
+            if simulator is not None and real:
+                simulator.add(obs_n, action_n, new_obs_n, tps, latency)
+                if simulator.fit():
+                    t_model = time.time()
+                    count = simulator.augment(trainers, arglist.model_rollouts, arglist.rollout_horizon, act_init, ACT_MAX)
+                    print("[Model] {} synthetic transitions in {:.3f}s".format(count, time.time() - t_model))
+            obs_n = new_obs_n
+
+            for i, rew in enumerate(rew_n):
+                episode_rewards[-1] += rew
+                agent_rewards[i][-1] += rew
+
+            if done or terminal:
+                obs_n = env.reset()
+                episode_step = 0
+                episode_rewards.append(0)
+                for a in agent_rewards:
+                    a.append(0)
+
+            # increment global step counter
+            train_step += 1
+
+            # update all trainers
+            if not arglist.async_step:
+                loss = update(train_step)
+
+            # save model, display training output
+            if terminal and (len(episode_rewards) % arglist.save_rate == 0):
+                if arglist.async_step:
+                    save_pending = True
+                else:
+                    save()
+                print("steps: {}, episodes: {}, mean episode reward: {}, time: {}".format(
+                    train_step, len(episode_rewards), np.mean(episode_rewards[-arglist.save_rate:]), round(time.time()-t_start, 3)))
+                t_start = time.time()
+                # Keep track of final episode reward
+                final_ep_rewards.append(np.mean(episode_rewards[-arglist.save_rate:]))
+                for rew in agent_rewards:
+                    final_ep_ag_rewards.append(np.mean(rew[-arglist.save_rate:]))
+
+            # saves final episode reward for plotting training curve later
+            if len(episode_rewards) > arglist.num_episodes:
+                save_rewards(arglist, final_ep_rewards, final_ep_ag_rewards)
+                print('...Finished total of {} episodes.'.format(len(episode_rewards)))
+                if save_pending:
+                    save()
+                break
+
+def train_lc_vec(arglist, build, session=None):
+    """
+    多集群训练: 每步将一批action分发到各集群, 每完成一个集群就存入经验并更新一次网络
+    params: 同train_lc
+    """
+    urls = arglist.cdt_urls.split(",")
+    print('train start with {} clusters...'.format(len(urls)))
+    with session or contextlib.nullcontext():
+        env = VecAigisEnv(urls, booted=False, act_importance=53,
+            obs_source=arglist.obs_source, derive_features=arglist.derive_features)
+        trainers, update, save, load = build(env)
+
+        if arglist.load_dir == "":
+            arglist.load_dir = arglist.save_dir
+        if arglist.restore:
+            print('Loading previous state...')
+            load()
+
+        episode_rewards = [0.0]  # mean over clusters of the summed agent rewards
+        final_ep_rewards = []
+        obs_envs = env.reset()
+        episode_step = 0
+        train_step = 0
+        t_start = time.time()
+        act_init = ACT_INIT
+
+        print('Starting iterations...')
+        while True:
+            print("Train_step now: {}".format(train_step))
+            act_init = max(act_init - ACT_STEP, ACT_MIN)
+            actions = [[np.clip(agent.action(obs), act_init, ACT_MAX) for agent, obs in zip(trainers, obs_n)]
+                       for obs_n in obs_envs]
+            env.step_async(actions)
+            episode_step += 1
+            terminal = (episode_step >= arglist.max_episode_len)
+            # 按完成顺序处理, 其余集群的benchmark仍在进行
+            for k, (new_obs_n, rew_n, done, info_n, tps, latency) in env.step_completed():
+                if is_real(info_n):
+                    for i, agent in enumerate(trainers):
+                        agent.experience(obs_envs[k][i], actions[k][i], rew_n[i], new_obs_n[i], done, terminal)
+                obs_envs[k] = new_obs_n
+                episode_rewards[-1] += sum(rew_n) / env.num_envs
+                train_step += 1
+                update(train_step)
+
+            if terminal:
+                obs_envs = env.reset()
+                episode_step = 0
+                episode_rewards.append(0)
+
+            if terminal and (len(episode_rewards) % arglist.save_rate == 0):
+                save()
+                print("steps: {}, episodes: {}, mean episode reward: {}, time: {}".format(
+                    train_step, len(episode_rewards), np.mean(episode_rewards[-arglist.save_rate:]), round(time.time()-t_start, 3)))
+                t_start = time.time()
+                final_ep_rewards.append(np.mean(episode_rewards[-arglist.save_rate:]))
+
+            if len(episode_rewards) > arglist.num_episodes:
+                save_rewards(arglist, final_ep_rewards)
+                print('...Finished total of {} episodes.'.format(len(episode_rewards)))
+                break
+
+def train(arglist, build, session=None):
+    """
+    --cdt-urls中有多个控制器时并行评估, 否则单集群训练
+    多集群训练不支持--surrogate/--model-rollouts/--async-step
+    """
+    if len(arglist.cdt_urls.split(",")) > 1:
+        unsupported = [flag for flag, used in (("--surrogate", arglist.surrogate),
+            ("--model-rollouts", arglist.model_rollouts > 0), ("--async-step", arglist.async_step)) if used]
+        if unsupported:
+            raise ValueError("{} not supported with multiple --cdt-urls".format(", ".join(unsupported)))
+        train_lc_vec(arglist, build, session)
+    else:
+        train_lc(arglist, build, session)
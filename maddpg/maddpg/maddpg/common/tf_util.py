@@ -30,7 +30,11 @@ def softmax(x, axis=None):
 
 
 def is_placeholder(x):
-    return type(x) is tf.Tensor and len(x.op.inputs) == 0
+    return type(x) is tf.Tensor and (len(x.op.inputs) == 0 or x.op.type == "PlaceholderWithDefault")
+
+
+def has_default(x):
+    return type(x) is tf.Tensor and x.op.type == "PlaceholderWithDefault"
 
 # ================================================================
 # Inputs
@@ -108,6 +112,34 @@ class Uint8Input(PlacholderTfInput):
         return self._output
 
 
+def staged_placeholder(shape, dtype=tf.float32, name=None):
+    """Creates a batch placeholder that defaults to a staging variable.
+
+    The variable lives in LOCAL_VARIABLES, so it is not checkpointed. A batch
+    uploaded once with the function returned by `make_stage` can be read by
+    every function built on the placeholder without feeding it again, while
+    feeding the placeholder still works as before.
+
+    Returns
+    -------
+    placeholder: tf.Tensor
+    variable: tf.Variable
+    """
+    shape = list(shape)
+    variable = tf.Variable(tf.zeros([0] + shape, dtype=dtype), trainable=False, validate_shape=False,
+                           collections=[tf.GraphKeys.LOCAL_VARIABLES],
+                           name=None if name is None else name + "_staged")
+    placeholder = tf.placeholder_with_default(tf.reshape(variable, [-1] + shape), [None] + shape, name=name)
+    return placeholder, variable
+
+
+def make_stage(variables):
+    """Returns f(*batches) that uploads one batch per staging variable in a single run."""
+    inputs = [tf.placeholder(var.dtype.base_dtype, name=var.op.name.split("/")[-1] + "_input") for var in variables]
+    updates = [tf.assign(var, inpt, validate_shape=False) for var, inpt in zip(variables, inputs)]
+    return function(inputs, [], updates=updates)
+
+
 def ensure_tf_input(thing):
     """Takes either tf.placeholder of TfInput and outputs equivalent TfInput"""
     if isinstance(thing, TfInput):
@@ -159,14 +191,29 @@ def get_session():
     return tf.get_default_session()
 
 
-def make_session(num_cpu):
-    """Returns a session that will use <num_cpu> CPU's only"""
+def make_session(num_cpu, intra_op_threads=None, inter_op_threads=None, xla=False):
+    """Returns a session that will use <num_cpu> CPU's only.
+
+    num_cpu=0 lets TensorFlow pick the thread pool sizes (all cores).
+    intra_op_threads/inter_op_threads override num_cpu for the respective
+    pool, xla turns on global XLA JIT compilation of the graph.
+    """
     tf_config = tf.ConfigProto(
-        inter_op_parallelism_threads=num_cpu,
-        intra_op_parallelism_threads=num_cpu)
+        inter_op_parallelism_threads=num_cpu if inter_op_threads is None else inter_op_threads,
+        intra_op_parallelism_threads=num_cpu if intra_op_threads is None else intra_op_threads)
+    if xla:
+        tf_config.graph_options.optimizer_options.global_jit_level = tf.OptimizerOptions.ON_1
     return tf.Session(config=tf_config)
 
 
+def session_from_args(arglist):
+    """Returns a session configured by the --num-cpu/--intra-op-threads/--inter-op-threads/--xla flags."""
+    return make_session(arglist.num_cpu,
+                        intra_op_threads=arglist.intra_op_threads,
+                        inter_op_threads=arglist.inter_op_threads,
+                        xla=arglist.xla)
+
+
 def single_threaded_session():
     """Returns a session which will only use a single CPU"""
     return make_session(1)
@@ -176,8 +223,9 @@ ALREADY_INITIALIZED = set()
 
 
 def initialize():
-    """Initialize all the uninitialized variables in the global scope."""
-    new_variables = set(tf.global_variables()) - ALREADY_INITIALIZED
+    """Initialize all the uninitialized global and local (staging) variables."""
+    new_variables = set(tf.global_variables()) | set(tf.local_variables())
+    new_variables -= ALREADY_INITIALIZED
     get_session().run(tf.variables_initializer(new_variables))
     ALREADY_INITIALIZED.update(new_variables)
 
@@ -290,13 +338,16 @@ class _Function(object):
     def __init__(self, inputs, outputs, updates, givens, check_nan=False):
         for inpt in inputs:
             if not issubclass(type(inpt), TfInput):
-                assert len(inpt.op.inputs) == 0, "inputs should all be placeholders of rl_algs.common.TfInput"
+                assert is_placeholder(inpt), "inputs should all be placeholders of rl_algs.common.TfInput"
         self.inputs = inputs
         updates = updates or []
         self.update_group = tf.group(*updates)
         self.outputs_update = list(outputs) + [self.update_group]
         self.givens = {} if givens is None else givens
         self.check_nan = check_nan
+        # Session.make_callable for calls that pass every input positionally
+        self._callable = None
+        self._callable_session = None
 
     def _feed_input(self, feed_dict, inpt, value):
         if issubclass(type(inpt), TfInput):
@@ -304,8 +355,38 @@ class _Function(object):
         elif is_placeholder(inpt):
             feed_dict[inpt] = value
 
+    def _fast_path(self):
+        """Positional calls skip building a feed_dict when every input is a single placeholder."""
+        sess = get_session()
+        if self._callable_session is not sess:
+            self._callable = None
+            self._callable_session = sess
+            feed_list = []
+            for inpt in self.inputs:
+                if type(inpt) in (PlacholderTfInput, BatchInput):
+                    feed_list.append(inpt.get())
+                elif is_placeholder(inpt):
+                    feed_list.append(inpt)
+                else:
+                    return None
+            self._callable = sess.make_callable(self.outputs_update, feed_list=feed_list)
+        return self._callable
+
     def __call__(self, *args, **kwargs):
         assert len(args) <= len(self.inputs), "Too many arguments provided"
+        fast = None
+        if not kwargs and not self.givens and len(args) == len(self.inputs):
+            fast = self._fast_path()
+        if fast is not None:
+            results = fast(*args)[:-1]
+        else:
+            results = self._call_feed_dict(args, kwargs)
+        if self.check_nan:
+            if any(np.isnan(r).any() for r in results):
+                raise RuntimeError("Nan detected")
+        return results
+
+    def _call_feed_dict(self, args, kwargs):
         feed_dict = {}
         # Update the args
         for inpt, value in zip(self.inputs, args):
@@ -321,13 +402,10 @@ class _Function(object):
                 kwargs_passed_inpt_names.add(inpt_name)
                 self._feed_input(feed_dict, inpt, kwargs.pop(inpt_name))
             else:
-                assert inpt in self.givens, "Missing argument " + inpt_name
+                # staged inputs read their staging variable when not fed
+                assert inpt in self.givens or has_default(inpt), "Missing argument " + inpt_name
         assert len(kwargs) == 0, "Function got extra arguments " + str(list(kwargs.keys()))
         # Update feed dict with givens.
         for inpt in self.givens:
             feed_dict[inpt] = feed_dict.get(inpt, self.givens[inpt])
-        results = get_session().run(self.outputs_update, feed_dict=feed_dict)[:-1]
-        if self.check_nan:
-            if any(np.isnan(r).any() for r in results):
-                raise RuntimeError("Nan detected")
-        return results
+        return get_session().run(self.outputs_update, feed_dict=feed_dict)[:-1]
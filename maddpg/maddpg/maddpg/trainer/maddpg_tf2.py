@@ -0,0 +1,345 @@
+"""TF2 eager implementation of the MADDPG trainer.
+
+Networks and optimizer state live in tf.Module objects, the train steps are
+tf.function graphs (optionally XLA compiled) and checkpoints are written with
+tf.train.Checkpoint. This module must not be imported together with
+maddpg.common.tf_util, maddpg.common.distributions or maddpg.trainer.maddpg,
+which switch TensorFlow to v1 behaviour at import time.
+"""
+import os
+import functools
+import numpy as np
+import tensorflow as tf
+
+from maddpg import AgentTrainer
+from maddpg.trainer.replay_buffer import ReplayBuffer
+
+
+class MLP(tf.Module):
+    """Two hidden relu layers, the same network as mlp_model in the experiments."""
+
+    def __init__(self, num_inputs, num_outputs, num_units=64, name=None):
+        super(MLP, self).__init__(name=name)
+        sizes = [num_inputs, num_units, num_units, num_outputs]
+        self.w = []
+        self.b = []
+        for i, (n_in, n_out) in enumerate(zip(sizes[:-1], sizes[1:])):
+            # glorot uniform, the tf.layers.dense default
+            limit = np.sqrt(6.0 / (n_in + n_out))
+            self.w.append(tf.Variable(tf.random.uniform([n_in, n_out], -limit, limit), name="w%d" % i))
+            self.b.append(tf.Variable(tf.zeros([n_out]), name="b%d" % i))
+
+    def __call__(self, x):
+        for i, (w, b) in enumerate(zip(self.w, self.b)):
+            x = tf.matmul(x, w) + b
+            if i < len(self.w) - 1:
+                x = tf.nn.relu(x)
+        return x
+
+
+class Adam(tf.Module):
+    """Adam with the tf.train.AdamOptimizer update rule.
+
+    Slots are created up front for `variables`, so the optimizer can be used
+    inside XLA compiled functions and restored before the first step.
+    """
+
+    def __init__(self, variables, learning_rate=1e-3, beta1=0.9, beta2=0.999, epsilon=1e-8, name=None):
+        super(Adam, self).__init__(name=name)
+        self.learning_rate = learning_rate
+        self.beta1 = beta1
+        self.beta2 = beta2
+        self.epsilon = epsilon
+        self.step = tf.Variable(0.0, trainable=False, name="step")
+        self.m = [tf.Variable(tf.zeros_like(var), trainable=False, name="m%d" % i) for i, var in enumerate(variables)]
+        self.v = [tf.Variable(tf.zeros_like(var), trainable=False, name="v%d" % i) for i, var in enumerate(variables)]
+
+    def apply_gradients(self, grads, variables):
+        step = self.step.assign_add(1.0)
+        lr = self.learning_rate * tf.sqrt(1.0 - self.beta2 ** step) / (1.0 - self.beta1 ** step)
+        for grad, var, m, v in zip(grads, variables, self.m, self.v):
+            m.assign(self.beta1 * m + (1.0 - self.beta1) * grad)
+            v.assign(self.beta2 * v + (1.0 - self.beta2) * tf.square(grad))
+            var.assign_sub(lr * m / (tf.sqrt(v) + self.epsilon))
+
+
+class DiagGaussianAction(object):
+    """Box actions, the network outputs mean and log std."""
+
+    def __init__(self, size):
+        self.sample_size = size
+        self.param_size = 2 * size
+
+    def sample(self, flat):
+        mean, logstd = tf.split(flat, 2, axis=1)
+        return mean + tf.exp(logstd) * tf.random.normal(tf.shape(mean))
+
+
+class SoftCategoricalAction(object):
+    """Discrete actions, relaxed with gumbel-softmax."""
+
+    def __init__(self, ncat):
+        self.sample_size = ncat
+        self.param_size = ncat
+
+    def sample(self, flat):
+        u = tf.random.uniform(tf.shape(flat))
+        return tf.nn.softmax(flat - tf.math.log(-tf.math.log(u)), axis=-1)
+
+
+def make_action_dist(act_space):
+    from gym import spaces
+    if isinstance(act_space, spaces.Box):
+        assert len(act_space.shape) == 1
+        return DiagGaussianAction(act_space.shape[0])
+    elif isinstance(act_space, spaces.Discrete):
+        return SoftCategoricalAction(act_space.n)
+    else:
+        raise NotImplementedError
+
+
+def obs_specs(obs_shape_n):
+    return [tf.TensorSpec([None] + list(shape), tf.float32) for shape in obs_shape_n]
+
+def act_specs(act_dist_n):
+    return [tf.TensorSpec([None, dist.sample_size], tf.float32) for dist in act_dist_n]
+
+def clip_gradients(grads, clip_val):
+    if clip_val is None:
+        return grads
+    return [tf.clip_by_norm(grad, clip_val) for grad in grads]
+
+def make_update_exp(vals, target_vals, tau=1e-2, jit_compile=False):
+    """Polyak averaging target <- (1 - tau) * target + tau * online."""
+    @tf.function(jit_compile=jit_compile)
+    def update():
+        for var, var_target in zip(vals, target_vals):
+            var_target.assign(var_target + tau * (var - var_target))
+    return update
+
+def q_train(obs_shape_n, act_space_n, q_index, q_func, optimizer, grad_norm_clipping=None, local_q_func=False, num_units=64, scope="trainer", jit_compile=False):
+    act_dist_n = [make_action_dist(act_space) for act_space in act_space_n]
+    obs_sizes = [int(np.prod(shape)) for shape in obs_shape_n]
+    if local_q_func:
+        num_inputs = obs_sizes[q_index] + act_dist_n[q_index].sample_size
+    else:
+        num_inputs = sum(obs_sizes) + sum(dist.sample_size for dist in act_dist_n)
+
+    q = q_func(num_inputs, 1, num_units=num_units, name=scope + "_q_func")
+    target_q = q_func(num_inputs, 1, num_units=num_units, name=scope + "_target_q_func")
+    q_optimizer = optimizer(q.trainable_variables)
+
+    def q_input(obs_n, act_n):
+        if local_q_func:
+            return tf.concat([obs_n[q_index], act_n[q_index]], 1)
+        return tf.concat(list(obs_n) + list(act_n), 1)
+
+    signature = [obs_specs(obs_shape_n), act_specs(act_dist_n)]
+
+    @tf.function(input_signature=signature + [tf.TensorSpec([None], tf.float32)], jit_compile=jit_compile)
+    def train(obs_n, act_n, target):
+        with tf.GradientTape() as tape:
+            q_values = q(q_input(obs_n, act_n))[:, 0]
+            loss = tf.reduce_mean(tf.square(q_values - target))
+        variables = q.trainable_variables
+        grads = clip_gradients(tape.gradient(loss, variables), grad_norm_clipping)
+        q_optimizer.apply_gradients(grads, variables)
+        return loss
+
+    @tf.function(input_signature=signature, jit_compile=jit_compile)
+    def q_values(obs_n, act_n):
+        return q(q_input(obs_n, act_n))[:, 0]
+
+    @tf.function(input_signature=signature, jit_compile=jit_compile)
+    def target_q_values(obs_n, act_n):
+        return target_q(q_input(obs_n, act_n))[:, 0]
+
+    # target network, soft-updated by MADDPGAgentTrainerTF2.target_update
+    return train, {'q_values': q_values, 'target_q_values': target_q_values,
+                   'q_func': q, 'target_q_func': target_q, 'optimizer': q_optimizer}
+
+def p_train(obs_shape_n, act_space_n, p_index, p_func, q_func, optimizer, grad_norm_clipping=None, local_q_func=False, num_units=64, scope="trainer", jit_compile=False):
+    """`q_func` is the agent's q network built by q_train, not a network factory."""
+    act_dist_n = [make_action_dist(act_space) for act_space in act_space_n]
+    act_dist = act_dist_n[p_index]
+    num_inputs = int(np.prod(obs_shape_n[p_index]))
+
+    p = p_func(num_inputs, act_dist.param_size, num_units=num_units, name=scope + "_p_func")
+    target_p = p_func(num_inputs, act_dist.param_size, num_units=num_units, name=scope + "_target_p_func")
+    p_optimizer = optimizer(p.trainable_variables)
+
+    signature = [obs_specs(obs_shape_n), act_specs(act_dist_n)]
+    obs_signature = [obs_specs(obs_shape_n)[p_index]]
+
+    @tf.function(input_signature=signature, jit_compile=jit_compile)
+    def train(obs_n, act_n):
+        with tf.GradientTape() as tape:
+            flat = p(obs_n[p_index])
+            act_input_n = list(act_n)
+            act_input_n[p_index] = act_dist.sample(flat)
+            if local_q_func:
+                q_input = tf.concat([obs_n[p_index], act_input_n[p_index]], 1)
+            else:
+                q_input = tf.concat(list(obs_n) + act_input_n, 1)
+            pg_loss = -tf.reduce_mean(q_func(q_input)[:, 0])
+            p_reg = tf.reduce_mean(tf.square(flat))
+            loss = pg_loss + p_reg * 1e-3
+        variables = p.trainable_variables
+        grads = clip_gradients(tape.gradient(loss, variables), grad_norm_clipping)
+        p_optimizer.apply_gradients(grads, variables)
+        return loss
+
+    @tf.function(input_signature=obs_signature, jit_compile=jit_compile)
+    def act(obs):
+        return act_dist.sample(p(obs))
+
+    @tf.function(input_signature=obs_signature, jit_compile=jit_compile)
+    def p_values(obs):
+        return p(obs)
+
+    @tf.function(input_signature=obs_signature, jit_compile=jit_compile)
+    def target_act(obs):
+        return act_dist.sample(target_p(obs))
+
+    # target network, soft-updated by MADDPGAgentTrainerTF2.target_update
+    return act, train, {'p_values': p_values, 'target_act': target_act,
+                        'p_func': p, 'target_p_func': target_p, 'optimizer': p_optimizer}
+
+def save_state(fname, trainers):
+    """Save the networks and optimizer state of all trainers to the location <fname>"""
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+    return tf.train.Checkpoint(**{trainer.name: trainer.module for trainer in trainers}).write(fname)
+
+def load_state(fname, trainers):
+    """Load the networks and optimizer state of all trainers from the location <fname>"""
+    return tf.train.Checkpoint(**{trainer.name: trainer.module for trainer in trainers}).read(fname)
+
+class MADDPGAgentTrainerTF2(AgentTrainer):
+    def __init__(self, name, model, obs_shape_n, act_space_n, agent_index, args, local_q_func=False):
+        """Same interface as MADDPGAgentTrainer, `model` builds a network as
+        model(num_inputs, num_outputs, num_units=..., name=...), e.g. MLP.
+        """
+        self.name = name
+        self.n = len(obs_shape_n)
+        self.agent_index = agent_index
+        self.args = args
+        self.obs_shape_n = obs_shape_n
+        self.act_space_n = act_space_n
+        self.tau = getattr(args, "tau", 1e-2)
+        self.target_update_interval = getattr(args, "target_update_interval", 1)
+        self.jit_compile = getattr(args, "xla", False)
+        self.update_count = 0
+        optimizer = functools.partial(Adam, learning_rate=args.lr)
+
+        # Create all the functions necessary to train the model
+        self.q_train, self.q_debug = q_train(
+            obs_shape_n=obs_shape_n,
+            act_space_n=act_space_n,
+            q_index=agent_index,
+            q_func=model,
+            optimizer=optimizer,
+            grad_norm_clipping=0.5,
+            local_q_func=local_q_func,
+            num_units=args.num_units,
+            scope=self.name,
+            jit_compile=self.jit_compile
+        )
+        self._act, self.p_train, self.p_debug = p_train(
+            obs_shape_n=obs_shape_n,
+            act_space_n=act_space_n,
+            p_index=agent_index,
+            p_func=model,
+            q_func=self.q_debug['q_func'],
+            optimizer=optimizer,
+            grad_norm_clipping=0.5,
+            local_q_func=local_q_func,
+            num_units=args.num_units,
+            scope=self.name,
+            jit_compile=self.jit_compile
+        )
+        # everything that is checkpointed for this agent
+        self.module = tf.Module(name=self.name)
+        self.module.p_func = self.p_debug['p_func']
+        self.module.target_p_func = self.p_debug['target_p_func']
+        self.module.p_optimizer = self.p_debug['optimizer']
+        self.module.q_func = self.q_debug['q_func']
+        self.module.target_q_func = self.q_debug['target_q_func']
+        self.module.q_optimizer = self.q_debug['optimizer']
+        # p and q target networks are averaged together in one function
+        self.target_update = make_update_exp(
+            self.module.p_func.trainable_variables + self.module.q_func.trainable_variables,
+            self.module.target_p_func.trainable_variables + self.module.target_q_func.trainable_variables,
+            self.tau, self.jit_compile)
+        # compiled on the first update, it needs the target policies of all agents
+        self._train_step = None
+        # Create experience buffer
+        self.replay_buffer = ReplayBuffer(1e6)
+        self.max_replay_buffer_len = args.batch_size * args.max_episode_len
+        self.replay_sample_index = None
+
+    def act(self, obs):
+        return self._act(np.asarray(obs, dtype=np.float32)).numpy()
+
+    def action(self, obs):
+        return self.act(np.asarray(obs)[None])[0]
+
+    def experience(self, obs, act, rew, new_obs, done, terminal):
+        # Store transition in the replay buffer.
+        self.replay_buffer.add(obs, act, rew, new_obs, float(done))
+
+    def experience_batch(self, obs, act, rew, new_obs, done):
+        # Store a batch of transitions, each argument has a leading batch axis.
+        self.replay_buffer.add_batch(obs, act, rew, new_obs, done)
+
+    def preupdate(self):
+        self.replay_sample_index = None
+
+    def _make_train_step(self, agents):
+        """Target computation, q step and p step of this agent as one tf.function."""
+        target_act_n = [agent.p_debug['target_act'] for agent in agents]
+        target_q_values = self.q_debug['target_q_values']
+        q_train, p_train = self.q_train, self.p_train
+        gamma = self.args.gamma
+        act_dist_n = [make_action_dist(act_space) for act_space in self.act_space_n]
+        batch = tf.TensorSpec([None], tf.float32)
+
+        @tf.function(input_signature=[obs_specs(self.obs_shape_n), act_specs(act_dist_n), batch,
+                                      obs_specs(self.obs_shape_n), batch], jit_compile=self.jit_compile)
+        def train_step(obs_n, act_n, rew, obs_next_n, done):
+            target_act_next_n = [target_act(obs_next) for target_act, obs_next in zip(target_act_n, obs_next_n)]
+            target_q_next = target_q_values(obs_next_n, target_act_next_n)
+            target_q = rew + gamma * (1.0 - done) * target_q_next
+            q_loss = q_train(obs_n, act_n, target_q)
+            p_loss = p_train(obs_n, act_n)
+            return q_loss, p_loss, target_q, target_q_next
+        return train_step
+
+    def update(self, agents, t):
+        if len(self.replay_buffer) < self.max_replay_buffer_len: # replay buffer is not large enough
+            return
+        if not t % 100 == 0:  # only update every 100 steps
+            return
+
+        self.replay_sample_index = self.replay_buffer.make_index(self.args.batch_size)
+        # collect replay sample from all agents
+        obs_n = []
+        obs_next_n = []
+        act_n = []
+        index = self.replay_sample_index
+        for i in range(self.n):
+            obs, act, rew, obs_next, done = agents[i].replay_buffer.sample_index(index)
+            obs_n.append(obs)
+            obs_next_n.append(obs_next)
+            act_n.append(act)
+        obs, act, rew, obs_next, done = self.replay_buffer.sample_index(index)
+
+        if self._train_step is None:
+            self._train_step = self._make_train_step(agents)
+        q_loss, p_loss, target_q, target_q_next = [
+            x.numpy() for x in self._train_step(obs_n, act_n, rew, obs_next_n, done)]
+
+        self.update_count += 1
+        if self.update_count % self.target_update_interval == 0:
+            self.target_update()
+
+        return [q_loss, p_loss, np.mean(target_q), np.mean(rew), np.mean(target_q_next), np.std(target_q)]
@@ -1,53 +1,104 @@
 import numpy as np
-import random
 
 class ReplayBuffer(object):
-    def __init__(self, size):
-        """Create Prioritized Replay buffer.
+    def __init__(self, size, initial_size=1024):
+        """Create a columnar Replay buffer.
+
+        Each field is stored in a contiguous float32 array whose shape is
+        taken from the first transition added. Storage grows by doubling
+        until it reaches `size`, then behaves as a ring buffer.
 
         Parameters
         ----------
         size: int
             Max number of transitions to store in the buffer. When the buffer
             overflows the old memories are dropped.
+        initial_size: int
+            Number of transitions allocated up front.
         """
-        self._storage = []
         self._maxsize = int(size)
+        self._initial_size = min(int(initial_size), self._maxsize)
+        self._obs_t = None
+        self._actions = None
+        self._rewards = None
+        self._obs_tp1 = None
+        self._dones = None
+        self._size = 0
         self._next_idx = 0
 
     def __len__(self):
-        return len(self._storage)
+        return self._size
 
     def clear(self):
-        self._storage = []
+        self._size = 0
         self._next_idx = 0
 
-    def add(self, obs_t, action, reward, obs_tp1, done):
-        data = (obs_t, action, reward, obs_tp1, done)
+    def _allocate(self, obs_t, action):
+        capacity = self._initial_size
+        self._obs_t = np.zeros((capacity,) + np.shape(obs_t), dtype=np.float32)
+        self._actions = np.zeros((capacity,) + np.shape(action), dtype=np.float32)
+        self._rewards = np.zeros(capacity, dtype=np.float32)
+        self._obs_tp1 = np.zeros((capacity,) + np.shape(obs_t), dtype=np.float32)
+        self._dones = np.zeros(capacity, dtype=np.float32)
 
-        if self._next_idx >= len(self._storage):
-            self._storage.append(data)
-        else:
-            self._storage[self._next_idx] = data
+    def _reserve(self, n):
+        """Grow the arrays so that n more transitions fit before wrapping."""
+        capacity = len(self._rewards)
+        if capacity >= self._maxsize or self._next_idx + n <= capacity:
+            return
+        new_capacity = capacity
+        while new_capacity < min(self._next_idx + n, self._maxsize):
+            new_capacity *= 2
+        new_capacity = min(new_capacity, self._maxsize)
+        for name in ("_obs_t", "_actions", "_rewards", "_obs_tp1", "_dones"):
+            old = getattr(self, name)
+            new = np.zeros((new_capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:capacity] = old
+            setattr(self, name, new)
+
+    def add(self, obs_t, action, reward, obs_tp1, done):
+        if self._obs_t is None:
+            self._allocate(obs_t, action)
+        self._reserve(1)
+        idx = self._next_idx
+        self._obs_t[idx] = obs_t
+        self._actions[idx] = action
+        self._rewards[idx] = reward
+        self._obs_tp1[idx] = obs_tp1
+        self._dones[idx] = done
         self._next_idx = (self._next_idx + 1) % self._maxsize
+        self._size = min(self._size + 1, self._maxsize)
+
+    def add_batch(self, obs_t, actions, rewards, obs_tp1, dones):
+        """Store a batch of transitions, each argument has a leading batch axis."""
+        n = len(rewards)
+        if n == 0:
+            return
+        if self._obs_t is None:
+            self._allocate(obs_t[0], actions[0])
+        if n > self._maxsize:
+            obs_t, actions, rewards, obs_tp1, dones = \
+                obs_t[-self._maxsize:], actions[-self._maxsize:], rewards[-self._maxsize:], \
+                obs_tp1[-self._maxsize:], dones[-self._maxsize:]
+            n = self._maxsize
+        self._reserve(n)
+        idxes = (self._next_idx + np.arange(n)) % self._maxsize
+        self._obs_t[idxes] = obs_t
+        self._actions[idxes] = actions
+        self._rewards[idxes] = rewards
+        self._obs_tp1[idxes] = obs_tp1
+        self._dones[idxes] = dones
+        self._next_idx = (self._next_idx + n) % self._maxsize
+        self._size = min(self._size + n, self._maxsize)
 
     def _encode_sample(self, idxes):
-        obses_t, actions, rewards, obses_tp1, dones = [], [], [], [], []
-        for i in idxes:
-            data = self._storage[i]
-            obs_t, action, reward, obs_tp1, done = data
-            obses_t.append(np.array(obs_t, copy=False))
-            actions.append(np.array(action, copy=False))
-            rewards.append(reward)
-            obses_tp1.append(np.array(obs_tp1, copy=False))
-            dones.append(done)
-        return np.array(obses_t), np.array(actions), np.array(rewards), np.array(obses_tp1), np.array(dones)
+        return self._obs_t[idxes], self._actions[idxes], self._rewards[idxes], self._obs_tp1[idxes], self._dones[idxes]
 
     def make_index(self, batch_size):
-        return [random.randint(0, len(self._storage) - 1) for _ in range(batch_size)]
+        return np.random.randint(0, self._size, batch_size)
 
     def make_latest_index(self, batch_size):
-        idx = [(self._next_idx - 1 - i) % self._maxsize for i in range(batch_size)]
+        idx = (self._next_idx - 1 - np.arange(batch_size)) % max(self._size, 1)
         np.random.shuffle(idx)
         return idx
 
@@ -79,7 +130,7 @@ class ReplayBuffer(object):
         if batch_size > 0:
             idxes = self.make_index(batch_size)
         else:
-            idxes = range(0, len(self._storage))
+            idxes = np.arange(self._size)
         return self._encode_sample(idxes)
 
     def collect(self):
@@ -0,0 +1,30 @@
+import importlib.util
+import os
+
+import numpy as np
+
+# 直接按路径加载, 不导入aigisenv包(其__init__依赖gym和requests)
+_PATH = os.path.join(os.path.dirname(__file__), "..", "experiments", "aigisenv", "features.py")
+_spec = importlib.util.spec_from_file_location("aigis_features", _PATH)
+features = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(features)
+
+
+def _state(total, timestamp, since):
+    prom = {node_type: [{"ledger_transaction_count_total": total}] for node_type in features.FeatureDeriver.NODE_TYPES}
+    return {"prom": prom, "types": {"ledger_transaction_count": "counter"}, "timestamp": timestamp, "since": since}
+
+
+def test_rate_within_benchmark():
+    deriver = features.FeatureDeriver()
+    deriver.derive(_state(100.0, 110.0, 100.0))
+    res = deriver.derive(_state(150.0, 120.0, 100.0))
+    assert np.allclose(res[0], [5.0])
+
+
+def test_reset_counter_above_previous_value():
+    deriver = features.FeatureDeriver()
+    deriver.derive(_state(100.0, 110.0, 100.0))
+    # 重新部署后计数器从0开始, 本次benchmark(since=200)内增长到300, 超过上次的100
+    res = deriver.derive(_state(300.0, 230.0, 200.0))
+    assert np.allclose(res[0], [10.0])
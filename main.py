@@ -1,35 +1,88 @@
 from flask import Flask, jsonify, request
 from utils import utils
 from collector import Collector
+from sampler import MetricsSampler
 import pdb
 import time
 import shutil
 import os
-from concurrent.futures import ThreadPoolExecutor
-import subprocess
 import json
+import queue
+import threading
+import atexit
 from deployer import Deployer
+from scheduler import JobScheduler, Job
+from deploy_executor import DeployExecutor
+from utils.readiness import ReadinessChecker
 
 # 全局变量
-STATEOFCDT = True
-# 创建线程池执行器
-executor = ThreadPoolExecutor(2)
+# 长轮询单次请求最长阻塞时间(s)
+WAIT_TIMEOUT_MAX = 120
+# 任务队列长度, 队列满时deploy接口返回429
+JOB_QUEUE_SIZE = 4
+# benchmark任务调度器, 所有任务串行执行
+scheduler = JobScheduler(JOB_QUEUE_SIZE)
 
-action_deployer = Deployer()
+CDT_TEMPLATE = "caliper-deploy-tool"
+# 多集群: 每个控制器实例负责config.yaml中caliper-eval的一个group, 监听不同端口
+CDT_GROUP = os.environ.get("CDT_GROUP")
+CDT_PORT = int(os.environ.get("CDT_PORT", 5000))
+# 该实例部署的ansible主机组
+CDT_HOSTS = os.environ.get("CDT_HOSTS", "cdt")
+# 每个group使用独立的caliper-deploy-tool副本, dist/report.html/action.yaml/crypto互不覆盖
+CDT_WORKDIR = os.environ.get("CDT_WORKDIR",
+    CDT_TEMPLATE + "-" + CDT_GROUP if CDT_GROUP else CDT_TEMPLATE)
+utils.prepare_workdir(CDT_TEMPLATE, CDT_WORKDIR)
 
-CONFIG_PATH = "caliper-deploy-tool/config.yaml"
+CONFIG_PATH = os.path.join(CDT_WORKDIR, "config.yaml")
 
-CDTIP = "192.168.0.25"
+action_deployer = Deployer(target_file=os.path.join(CDT_WORKDIR, "action.yaml"))
 
 app = Flask(__name__)
 cdt_config = utils.load_config(CONFIG_PATH)
+if CDT_GROUP:
+    cdt_config = utils.select_group(cdt_config, CDT_GROUP)
 node_metrics_points = utils.get_node_endpoints(cdt_config)
+# CoreDNS/NFS所在主机的地址, 未设置时使用config.yaml中的dnsserver
+CDTIP = os.environ.get("CDTIP") or utils.get_dns_server(cdt_config)
 
-reportfile = 'caliper-deploy-tool/report.html'
+reportfile = os.path.join(CDT_WORKDIR, "report.html")
 channel_name = 'mychannel'
 chaincode_name = 'smallbank'
 print("using channe name: {}, chaincode name: {}".format(channel_name, chaincode_name))
-metrics_collector = Collector(node_metrics_points, reportfile, channel_name, chaincode_name)
+# 并发抓取各节点metrics, SCRAPE_DEADLINE内未返回的节点会被丢弃
+# benchmark期间每SAMPLE_INTERVAL秒采样一次, 每个metric最多保留SAMPLE_CAPACITY个样本
+# SCRAPE_DEADLINE必须小于SAMPLE_INTERVAL, 否则慢节点的抓取会在线程池中堆积
+SCRAPE_WORKERS = 16
+SCRAPE_DEADLINE = 3
+SAMPLE_INTERVAL = 5
+SAMPLE_CAPACITY = 720
+assert SCRAPE_DEADLINE < SAMPLE_INTERVAL
+metrics_collector = Collector(node_metrics_points, reportfile, channel_name, chaincode_name,
+    max_workers=SCRAPE_WORKERS, deadline=SCRAPE_DEADLINE)
+metrics_sampler = MetricsSampler(metrics_collector, interval=SAMPLE_INTERVAL, capacity=SAMPLE_CAPACITY)
+atexit.register(metrics_collector.close)
+atexit.register(metrics_sampler.stop)
+# deploy-fabric-up后等待网络就绪的最长时间(s), 就绪后立即启动caliper
+READY_TIMEOUT = 90
+READY_INTERVAL = 2
+# ansible-playbook的--forks, 任一主机deploy-fabric-up失败时立即终止整个playbook
+DEPLOY_FAN_OUT = 8
+deploy_env = {"CDTIP": CDTIP}
+if CDT_GROUP:
+    # make generate/render时只渲染该group的节点, caliper容器按group命名
+    deploy_env["GROUP"] = CDT_GROUP
+    deploy_env["CDT_CONTAINER"] = "cdt-" + CDT_GROUP
+    # CoreDNS和NFS只挂载模板目录, crypto复制到NFS的group子目录, 域名合并到共享的hostsfile
+    deploy_env["NFS_EXPORT"] = os.path.abspath(os.path.join(CDT_TEMPLATE, "benchmarks", "config_raft"))
+    deploy_env["SHARED_HOSTSFILE"] = os.path.abspath(os.path.join(CDT_TEMPLATE, "dns", "coredns", "hostsfile"))
+deploy_executor = DeployExecutor(workdir=CDT_WORKDIR, group=CDT_HOSTS, fan_out=DEPLOY_FAN_OUT, env=deploy_env)
+# 增量部署: configtx未变化且网络仍在运行时, 只重新渲染配置并recreate参数变化的容器
+# recreate后的peer/orderer依赖ledgerpath中保留的账本恢复channel, 验证之前默认关闭
+INCREMENTAL_REDEPLOY = os.environ.get("CDT_INCREMENTAL", "false") == "true"
+# 当前运行中网络的action.yaml, 网络停止或部署失败时为None
+deployed_action = None
+readiness_checker = ReadinessChecker(cdt_config, timeout=READY_TIMEOUT, interval=READY_INTERVAL)
 
 
 
@@ -37,36 +90,108 @@ metrics_collector = Collector(node_metrics_points, reportfile, channel_name, cha
 def index():
     return "Hello, Aigis!"
 
-# v1 metrics接口
-@app.route('/cdt/metrics', methods=['GET'])
-def get_metrics():
+def collect_metrics():
     # 获取所有peer的平均metrics
     res= {}
     # res['prom'] = metrics_collector.collect_from_prometheus(utils.handler_metrics_prom)
+    res['timestamp'] = time.time()
     res['prom'] = metrics_collector.collect_from_prometheus()
+    res['status'] = metrics_collector.get_scrape_status()
     res['caliper'] = metrics_collector.collect_from_caliper()
+    # benchmark窗口内的delta/rate/p50/p95
+    res['window'] = metrics_sampler.summary()
+    # 用于客户端计算counter速率: 样本类型、抓取时间和benchmark开始时间
+    res['types'] = metrics_collector.get_metric_types()
+    res['since'] = metrics_sampler.started
     # utils.gen_limitscsv(res['prom'])
     return res
 
+# /cdt/metrics结果缓存, key为report.html的(mtime, inode), 新的部署开始时失效
+metrics_cache = {"key": None, "value": None}
+metrics_cache_lock = threading.Lock()
+
+def cached_metrics():
+    """
+    同一份report重复读取时直接返回缓存的prom + caliper结果
+    """
+    try:
+        stat = os.stat(reportfile)
+        key = (stat.st_mtime_ns, stat.st_ino)
+    except OSError:
+        key = None
+    with metrics_cache_lock:
+        if key is not None and metrics_cache["key"] == key:
+            return metrics_cache["value"]
+    value = collect_metrics()
+    if key is not None:
+        with metrics_cache_lock:
+            metrics_cache["key"] = key
+            metrics_cache["value"] = value
+    return value
+
+def invalidate_metrics_cache():
+    with metrics_cache_lock:
+        metrics_cache["key"] = None
+        metrics_cache["value"] = None
+
+# v1 metrics接口
+@app.route('/cdt/metrics', methods=['GET'])
+def get_metrics():
+    return cached_metrics()
+
+@app.route('/cdt/jobs', methods=['GET'])
+def list_jobs():
+    return jsonify(scheduler.jobs())
+
+@app.route('/cdt/jobs/<int:job_id>', methods=['GET'])
+def get_job(job_id):
+    job = scheduler.get(job_id)
+    if job is None:
+        return jsonify({"error": "job {} not found".format(job_id)}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/cdt/action/wait', methods=['GET'])
+def wait_job():
+    """
+    长轮询: 阻塞到任务结束(或timeout秒)后返回
+    params: job_id(默认最新任务), timeout(s)
+    return: job信息, 结束时附带metrics
+    """
+    job_id = request.args.get("job_id", type=int)
+    timeout = min(request.args.get("timeout", default=30, type=float), WAIT_TIMEOUT_MAX)
+    if job_id is None:
+        latest = scheduler.latest()
+        job_id = latest.id if latest is not None else 0
+    job = scheduler.wait(job_id, timeout)
+    if job is None:
+        return jsonify({"error": "job {} not found".format(job_id)}), 404
+    return jsonify(job.to_dict())
+
 
 @app.route('/cdt/action/status', methods=['GET'])
 def get_status():
-    global STATEOFCDT
-    base_dir = os.path.dirname(__file__)
-    target_file = os.path.join(base_dir, "caliper-deploy-tool", "report.html")
-    if os.path.exists(target_file):
+    """
+    最新任务排队或执行中时返回Running, 此时report.html可能仍是上一个任务的结果
+    """
+    job = scheduler.latest()
+    if job is not None and job.state not in Job.FINISHED:
+        return "Running"
+    elif os.path.exists(reportfile):
         return "Exist"
-    elif not STATEOFCDT:
-        STATEOFCDT = True
+    elif job is not None and job.state == Job.FAILED:
         return "Retry"
     else:
         return "Not Found"
 
 @app.route('/cdt/reset', methods=['GET'])
 def reset_status():
-    global STATEOFCDT
-    STATEOFCDT = False
-    return "State of cdt: {}\n".format(STATEOFCDT)
+    """
+    取消排队中的最新任务, 正在执行的任务无法安全中断, 返回409
+    """
+    job = scheduler.latest()
+    if job is not None and not scheduler.cancel(job.id, "reset") and job.state not in Job.FINISHED:
+        return "State of cdt: {}, job {} is running\n".format(job.state, job.id), 409
+    return "State of cdt: {}\n".format(job.state if job is not None else None)
 
 @app.route('/cdt/action/limits', methods=['GET'])
 def get_limits():
@@ -82,110 +207,125 @@ def get_ddpg_limits():
 def get_default():
     # pdb.set_trace()
     return action_deployer.get_default()
-    
+
+def archive_report():
+    """
+    移动report.html到history文件夹
+    """
+    print("Current dir: " + CDT_WORKDIR)
+    target_dir = os.path.join(CDT_WORKDIR, "history")
+    source_file = reportfile
+    print("src: %s,\t target: %s" % (source_file, target_dir))
+    if not os.path.exists(target_dir):
+        os.mkdir(target_dir)
+    try:
+        shutil.move(source_file, os.path.join(target_dir, "report-" +str(int(time.time())) + ".html"))
+    except IOError as e:
+        print(e)
+
+def run_make(job, phase, target, check=True):
+    with job.phase(phase):
+        deploy_executor.make(target, check)
+
+def run_hosts(job, phase, target, fail_fast=True):
+    """
+    对所有主机并发执行make目标并记录各主机耗时
+    """
+    with job.phase(phase):
+        job.host_phase(phase, deploy_executor.fan_out(target, fail_fast))
+
 # benchmark
-def invoke_cdt(auto_stop = False):
-    global STATEOFCDT
-    STATEOFCDT = True
+def invoke_cdt(job, auto_stop = False, action = None):
+    global deployed_action
+    job.set_state(Job.DEPLOYING)
+    invalidate_metrics_cache()
+    previous, deployed_action = deployed_action, None
     if auto_stop:
-        shell_cmd_down = "export CDTIP=%s; cd caliper-deploy-tool; make deploy-fabric-down" % CDTIP
-        subprocess.call(shell_cmd_down, shell=True)
+        run_hosts(job, "down", "deploy-fabric-down", fail_fast=False)
+        return None
+
+    changed = Deployer.diff(previous, action)
+    if INCREMENTAL_REDEPLOY and previous is not None and "configtx" not in changed:
+        # genesis不变, 复用crypto和channel; docker-compose只recreate配置变化的service(peer/orderer)
+        print("Incremental redeploy, changed: {}".format(sorted(changed)))
+        if changed:
+            run_make(job, "render", "render")
+            run_hosts(job, "up", "deploy-fabric-up")
     else:
-        shell_cmd_down = "export CDTIP=%s; cd caliper-deploy-tool; make deploy-fabric-down" % CDTIP
-        subprocess.call(shell_cmd_down, shell=True)
-        
-        shell_cmd_umount = "ansible cdt -m shell -a 'umount -l /root/ansible/nfs'"
-        subprocess.call(shell_cmd_umount, shell=True)
+        print("Full redeploy, changed: {}".format(sorted(changed)))
+        run_hosts(job, "down", "deploy-fabric-down", fail_fast=False)
+
+        with job.phase("umount"):
+            shell_cmd_umount = "ansible %s --forks %d -m shell -a 'umount -l /root/ansible/nfs'" % (CDT_HOSTS, DEPLOY_FAN_OUT)
+            deploy_executor.call(shell_cmd_umount)
+
+        run_make(job, "generate", "generate")
+        run_make(job, "setup", "setup-config")
+        run_hosts(job, "up", "deploy-fabric-up")
+
+    # Wait for Fabric network (especially CA) to be fully ready
+    with job.phase("wait"):
+        print("Waiting up to {}s for Fabric network to initialize...".format(READY_TIMEOUT))
+        ready, elapsed = readiness_checker.wait()
+        print("Fabric network {} after {:.1f}s".format("ready" if ready else "still not ready", elapsed))
+
+    job.set_state(Job.BENCHMARKING)
+    metrics_sampler.start()
+    try:
+        run_make(job, "benchmark", "start-cdt", check=False)
+    finally:
+        metrics_sampler.stop()
+
+    if not os.path.exists(reportfile):
+        raise RuntimeError("benchmark finished without report")
+    deployed_action = action
+    # benchmark完成后直接附带metrics, 客户端无需再请求/cdt/metrics
+    with job.phase("collect"):
+        return cached_metrics()
 
-        shell_cmd_generate = "export CDTIP=%s; cd caliper-deploy-tool; make generate" % CDTIP
-        subprocess.call(shell_cmd_generate, shell=True)
+def deploy_job(job, config):
+    """
+    在调度器线程中写入action.yaml, 避免排队的任务互相覆盖
+    """
+    job.set_state(Job.DEPLOYING)
+    with job.phase("config"):
+        if config is None:
+            utils.save_config(utils.load_config("action.default.yaml"), os.path.join(CDT_WORKDIR, "action.yaml"))
+        else:
+            action_deployer.generate(config)
+        archive_report()
+    return invoke_cdt(job, action=action_deployer.load_target())
 
-        shell_cmd_setup = "export CDTIP=%s; cd caliper-deploy-tool; make setup-config" % CDTIP
-        subprocess.call(shell_cmd_setup, shell=True)
+def down_job(job):
+    result = invoke_cdt(job, True)
+    archive_report()
+    return result
 
-        shell_cmd_up = "export CDTIP=%s; cd caliper-deploy-tool; make deploy-fabric-up" % CDTIP
-        subprocess.call(shell_cmd_up, shell=True)
-        
-        # Wait for Fabric network (especially CA) to be fully ready
-        print("Waiting 30s for Fabric network to initialize...")
-        time.sleep(30)
-        
-        shell_cmd_start = "export CDTIP=%s; cd caliper-deploy-tool; make start-cdt" % CDTIP
-        subprocess.call(shell_cmd_start, shell=True)
+def submit_job(kind, func, *args):
+    try:
+        job = scheduler.submit(kind, func, *args)
+    except queue.Full:
+        return jsonify({"error": "job queue is full"}), 429
+    return jsonify({"job_id": job.id, "state": job.state, "status": "Good"})
 
 
 @app.route('/cdt/deploy/up', methods=['POST'])
 def deploy():
-    # 1. 获取配置信息重新生成配置文件
+    # 1. 获取配置信息, 由任务生成配置文件并benchmark
     config = json.loads(request.data.decode())
     print("config data: ", config)
-    action_deployer.generate(config)
-    # 2. 移动report.html到history文件夹
-    base_dir = os.path.dirname(__file__)
-    print("Current dir: " + base_dir)
-    target_dir = os.path.join(base_dir, "caliper-deploy-tool", "history")
-    source_file = os.path.join(base_dir, "caliper-deploy-tool", "report.html")
-    print("src: %s,\t target: %s" % (source_file, target_dir))
-    if not os.path.exists(target_dir):
-        os.mkdir(target_dir)
-    try:
-        shutil.move(source_file, os.path.join(target_dir, "report-" +str(int(time.time())) + ".html"))
-    except IOError as e:
-        print(e)
-    
-
-    # 3.benchmark
-    executor.submit(invoke_cdt)
-
-    return "Good"
+    return submit_job("deploy", deploy_job, config)
 
 @app.route('/cdt/deploy/default', methods=['POST'])
 def deploy_default():
-    # 1. 获取配置信息重新生成配置文件
-    config = utils.load_config("action.default.yaml")
-    # pdb.set_trace()
-    print(config)
-    utils.save_config(config, "caliper-deploy-tool/action.yaml")
-    # 2. 移动report.html到history文件夹
-    base_dir = os.path.dirname(__file__)
-    print("Current dir: " + base_dir)
-    target_dir = os.path.join(base_dir, "caliper-deploy-tool", "history")
-    source_file = os.path.join(base_dir, "caliper-deploy-tool", "report.html")
-    print("src: %s,\t target: %s" % (source_file, target_dir))
-    if not os.path.exists(target_dir):
-        os.mkdir(target_dir)
-    try:
-        shutil.move(source_file, os.path.join(target_dir, "report-" +str(int(time.time())) + ".html"))
-    except IOError as e:
-        print(e)
-    
-
-    # 3.benchmark
-    executor.submit(invoke_cdt)
-
-    return "Good"
+    # 使用action.default.yaml
+    return submit_job("default", deploy_job, None)
 
 @app.route('/cdt/deploy/down', methods=['DELETE'])
 def deploy_down():
-    
-    # 1. 开始删除容器
-    executor.submit(invoke_cdt, True)
-
-    # 2. 移动report.html到history文件夹
-    base_dir = os.path.dirname(__file__)
-    print("Current dir: " + base_dir)
-    target_dir = os.path.join(base_dir, "caliper-deploy-tool", "history")
-    source_file = os.path.join(base_dir, "caliper-deploy-tool", "report.html")
-    print("src: %s,\t target: %s" % (source_file, target_dir))
-    if not os.path.exists(target_dir):
-        os.mkdir(target_dir)
-    try:
-        shutil.move(source_file, os.path.join(target_dir, "report-" +str(int(time.time())) + ".html"))
-    except IOError as e:
-        print(e)
-
-    return "deploy_down"
+    # 删除容器并移动report.html到history文件夹
+    return submit_job("down", down_job)
 
 
 if __name__ == '__main__':
-    app.run(host = "0.0.0.0", debug=True)
\ No newline at end of file
+    app.run(host = "0.0.0.0", port=CDT_PORT, debug=True)
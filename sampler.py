@@ -0,0 +1,147 @@
+import threading
+import time
+import numpy as np
+
+
+class RingBuffer(object):
+    """
+    定长时间序列缓存: 每个metric一个numpy数组, 写满后覆盖最旧的样本
+    缺失的样本为NaN
+    """
+
+    def __init__(self, capacity):
+        self._capacity = capacity
+        self._times = np.zeros(capacity)
+        self._series = {}
+        self._count = 0
+
+    def __len__(self):
+        return min(self._count, self._capacity)
+
+    def clear(self):
+        self._series = {}
+        self._count = 0
+
+    def append(self, timestamp, values):
+        """
+        values: {metric: value}
+        """
+        index = self._count % self._capacity
+        self._times[index] = timestamp
+        for key in values:
+            series = self._series.get(key)
+            if series is None:
+                series = np.full(self._capacity, np.nan)
+                self._series[key] = series
+            series[index] = values[key]
+        # 本次未出现的metric记为NaN
+        for key in self._series.keys() - values.keys():
+            self._series[key][index] = np.nan
+        self._count += 1
+
+    def _order(self):
+        n = len(self)
+        if self._count <= self._capacity:
+            return np.arange(n)
+        return (np.arange(n) + self._count) % self._capacity
+
+    def times(self):
+        return self._times[self._order()]
+
+    def items(self):
+        order = self._order()
+        for key in self._series:
+            yield key, self._series[key][order]
+
+
+class MetricsSampler(object):
+    """
+    benchmark期间按固定间隔抓取所有endpoint, 结束后给出窗口内的
+    增量(delta)、速率(rate, /s)和分位数(p50, p95)
+    params:
+    collector: Collector
+    interval: 抓取间隔(s)
+    capacity: 每个metric保留的样本数
+    """
+    NODE_TYPES = ("peer", "orderer", "peer-net")
+
+    def __init__(self, collector, interval=5, capacity=720):
+        self._collector = collector
+        self._interval = interval
+        self._capacity = capacity
+        self._buffers = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        # 最近一次采样窗口的开始时间
+        self.started = None
+
+    def start(self):
+        self.stop()
+        with self._lock:
+            self._buffers = {}
+        self.started = time.time()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="metrics-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            start = time.time()
+            try:
+                self.sample()
+            except Exception as e:
+                print("metrics sampler failed: {}".format(e))
+            self._stop.wait(max(self._interval - (time.time() - start), 0))
+
+    def sample(self):
+        """
+        抓取一次并写入各endpoint的ring buffer
+        """
+        timestamp = time.time()
+        results = self._collector.collect_by_endpoint()
+        with self._lock:
+            for node_type in self.NODE_TYPES:
+                for url, data in results[node_type].items():
+                    buffer = self._buffers.get((node_type, url))
+                    if buffer is None:
+                        buffer = RingBuffer(self._capacity)
+                        self._buffers[(node_type, url)] = buffer
+                    buffer.append(timestamp, data)
+
+    def summary(self):
+        """
+        return: {node_type: [{metric_delta, metric_rate, metric_p50, metric_p95}],
+                 "samples": 样本数, "duration": 窗口长度(s)}
+        node_type下每个endpoint一个dict, 与collect_from_prometheus的结构一致
+        """
+        res = {node_type: [] for node_type in self.NODE_TYPES}
+        samples, duration = 0, 0.0
+        with self._lock:
+            for (node_type, url), buffer in self._buffers.items():
+                times = buffer.times()
+                samples = max(samples, len(times))
+                data = {}
+                for key, values in buffer.items():
+                    valid = ~np.isnan(values)
+                    if not valid.any():
+                        continue
+                    first, last = np.flatnonzero(valid)[[0, -1]]
+                    delta = values[last] - values[first]
+                    elapsed = times[last] - times[first]
+                    duration = max(duration, elapsed)
+                    p50, p95 = np.percentile(values[valid], [50, 95])
+                    data[key + "_delta"] = float(delta)
+                    data[key + "_rate"] = float(delta / elapsed) if elapsed > 0 else 0.0
+                    data[key + "_p50"] = float(p50)
+                    data[key + "_p95"] = float(p95)
+                res[node_type].append(data)
+        res["samples"] = samples
+        res["duration"] = duration
+        return res
@@ -0,0 +1,167 @@
+import threading
+import queue
+import time
+import itertools
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class Job(object):
+    """
+    benchmark任务
+    state: queued -> deploying -> benchmarking -> done | failed
+    phases: 各阶段耗时(s), 如down/generate/up/benchmark/collect
+    hosts: 按主机并发执行的阶段中各主机的耗时(s), {host: {phase: s}}
+    """
+    QUEUED = "queued"
+    DEPLOYING = "deploying"
+    BENCHMARKING = "benchmarking"
+    DONE = "done"
+    FAILED = "failed"
+    FINISHED = (DONE, FAILED)
+
+    def __init__(self, job_id, kind, func, args):
+        self.id = job_id
+        self.kind = kind
+        self.state = Job.QUEUED
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.phases = OrderedDict()
+        self.hosts = {}
+        self.metrics = None
+        self.error = None
+        self._func = func
+        self._args = args
+        self._scheduler = None
+
+    def set_state(self, state):
+        self._scheduler._update(self, state)
+
+    @contextmanager
+    def phase(self, name):
+        """
+        记录一个阶段的耗时
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.phases[name] = round(time.time() - start, 3)
+
+    def host_phase(self, name, timings):
+        """
+        记录一个阶段中各主机的耗时, timings: {host: s}
+        """
+        for host in timings:
+            self.hosts.setdefault(host, OrderedDict())[name] = timings[host]
+
+    def to_dict(self, with_metrics=True):
+        res = {
+            "job_id": self.id,
+            "kind": self.kind,
+            "state": self.state,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "phases": dict(self.phases),
+            "hosts": {host: dict(self.hosts[host]) for host in self.hosts},
+            "error": self.error
+        }
+        if with_metrics:
+            res["metrics"] = self.metrics
+        return res
+
+
+class JobScheduler(object):
+    """
+    串行执行benchmark任务的调度器
+    params:
+    maxsize: 等待队列长度，队列满时submit抛出queue.Full
+    history: 保留的任务记录数
+    """
+
+    def __init__(self, maxsize=4, history=100):
+        self._queue = queue.Queue(maxsize)
+        self._cond = threading.Condition()
+        self._jobs = OrderedDict()
+        self._history = history
+        self._ids = itertools.count(1)
+        self._worker = threading.Thread(target=self._run, name="job-scheduler", daemon=True)
+        self._worker.start()
+
+    def submit(self, kind, func, *args):
+        """
+        提交任务, func(job, *args)在worker线程中执行，
+        返回值作为job.metrics, 抛出异常则任务失败
+        """
+        with self._cond:
+            job = Job(next(self._ids), kind, func, args)
+            job._scheduler = self
+            self._queue.put_nowait(job)
+            self._jobs[job.id] = job
+            while len(self._jobs) > self._history:
+                self._jobs.popitem(last=False)
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def latest(self):
+        with self._cond:
+            return next(reversed(self._jobs.values()), None)
+
+    def jobs(self):
+        with self._cond:
+            return [job.to_dict(with_metrics=False) for job in self._jobs.values()]
+
+    def cancel(self, job_id, error):
+        """
+        取消尚未开始执行的任务(如/cdt/reset), 正在执行的任务不能中断
+        return: 是否已取消
+        """
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or job.state != Job.QUEUED or job.started is not None:
+                return False
+            job.error = error
+            self._update(job, Job.FAILED)
+            return True
+
+    def wait(self, job_id, timeout):
+        """
+        阻塞直到任务结束或超时，返回job(不存在时为None)
+        """
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                self._cond.wait_for(lambda: job.state in Job.FINISHED, timeout)
+            return job
+
+    def _update(self, job, state):
+        with self._cond:
+            # 结束状态不可再变更
+            if job.state in Job.FINISHED:
+                return
+            job.state = state
+            if state in Job.FINISHED:
+                job.finished = time.time()
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            # 与cancel互斥, 开始执行后不能再取消
+            with self._cond:
+                if job.state in Job.FINISHED:
+                    continue
+                job.started = time.time()
+            job.phases["queued"] = round(job.started - job.created, 3)
+            try:
+                job.metrics = job._func(job, *job._args)
+            except Exception as e:
+                print("job {} failed: {}".format(job.id, e))
+                job.error = str(e)
+                job.set_state(Job.FAILED)
+            else:
+                job.set_state(Job.DONE)
@@ -2,83 +2,167 @@ import requests
 # def factory_metric():
 #         return {'key': None, 'label':[], 'value': 0}
 # res = defaultdict(factoryheader)
+
+
+def _parse_labels(line, start):
+    """
+    单遍解析label, line[start]为'{'
+    支持label值中的转义(\\" \\\\ \\n)以及逗号、空格
+    return: (labels, '}'之后的位置)
+    """
+    labels = {}
+    i = start + 1
+    n = len(line)
+    while i < n:
+        c = line[i]
+        if c == '}':
+            return labels, i + 1
+        if c == ',' or c == ' ':
+            i += 1
+            continue
+        eq = line.index('=', i)
+        key = line[i:eq].strip()
+        i = line.index('"', eq) + 1
+        buf = []
+        while True:
+            quote = line.index('"', i)
+            slash = line.find('\\', i, quote)
+            if slash == -1:
+                buf.append(line[i:quote])
+                i = quote + 1
+                break
+            buf.append(line[i:slash])
+            esc = line[slash + 1]
+            buf.append('\n' if esc == 'n' else esc)
+            i = slash + 2
+        labels[key] = ''.join(buf)
+    raise ValueError("unterminated label set")
+
+
 class Metrics(object):
     """
     Peer Metrics 解释器
     """
 
-    def __init__(self, url, filters:list):
+    def __init__(self, url, filters, session=None):
         """
-        param: filter: metrics参数过滤器
+        param: filter: metrics参数过滤器, list或{bucket: list}
+               为dict时只抓取一次, 由interprete_buckets按bucket分发
+        param: session: 共享的requests.Session(连接池)，为None时每次新建连接
         """
-        self._filter = filters
+        if isinstance(filters, dict):
+            self._buckets = filters
+            self._filter = [key for bucket in filters.values() for key in bucket]
+        else:
+            self._buckets = None
+            self._filter = filters
+        # 预编译过滤集合: 在分配任何对象之前按metric名称过滤
+        self._names = frozenset(name.encode() for name in self._filter) if self._filter else None
+        self._index = {}
+        if self._buckets is not None:
+            for bucket in self._buckets:
+                for key in self._buckets[bucket]:
+                    self._index.setdefault(key, []).append(bucket)
         self._url = url
-    
+        self._session = session
+        # 最近一次抓取的错误信息，成功时为None
+        self.error = None
+        # 由"# TYPE"行得到的样本类型: {样本名: counter|gauge|histogram|summary}
+        self.types = {}
+
+    @property
+    def url(self):
+        return self._url
+
     @property
     def schema(self):
         return {'key': None, 'label':{}, 'value': 0}
-        
 
-    def interprete(self) -> dict:
+    def _parse_type(self, raw):
+        """
+        解析"# TYPE <name> <type>", histogram/summary的类型同时记到_sum/_count样本上
+        """
+        parts = raw.split()
+        if len(parts) < 4:
+            return
+        name, kind = parts[2], parts[3].decode('utf-8')
+        for sample in (name, name + b'_sum', name + b'_count', name + b'_total'):
+            if self._names is None or sample in self._names:
+                self.types[sample.decode('utf-8')] = kind
+
+    def _parse_line(self, raw):
+        """
+        解析单行样本, 不在过滤集合中的metric直接返回None
+        """
+        brace = raw.find(b'{')
+        space = raw.find(b' ')
+        end = brace if brace != -1 and (space == -1 or brace < space) else space
+        if end <= 0:
+            return None
+        name = raw[:end]
+        if self._names is not None and name not in self._names:
+            return None
+
+        line = raw.decode('utf-8')
+        metric_item = self.schema
+        metric_item['key'] = name.decode('utf-8')
+        if end == brace:
+            metric_item['label'], end = _parse_labels(line, end)
+        # value后面可能跟timestamp
+        metric_item['value'] = float(line[end:].split()[0])
+        return metric_item
+
+    def interprete(self, timeout=5) -> list:
         """
-        解析
+        流式解析: 逐行读取，先按名称过滤再解析label和value
+        param: timeout: 请求超时时间(s)
         """
         metrics = []
-        
+        self.error = None
+
         try:
-            response = requests.request("GET", self._url, timeout=5)
-            data = response.text
+            http = self._session if self._session is not None else requests
+            response = http.request("GET", self._url, timeout=timeout, stream=True)
         except Exception as e:
             print(f"Error fetching metrics from {self._url}: {e}")
+            self.error = str(e)
             return []
 
-        lines = data.split('\n')
-        for line in lines:
-            if line.startswith('# ') or len(line) == 0:
-                continue
-
-            try:
-                metric_item = self.schema.copy() # Use copy to avoid reference issues
-                # factory_metric returns a new dict, but here self.schema is a property returning a new dict? 
-                # Property implementation: return {'key': None, 'label':{}, 'value': 0} -> Yes, it returns a new dict.
-                # But let's be safe.
-                
-                line_parts = line.split(' ')
-                if len(line_parts) < 2:
+        try:
+            for raw in response.iter_lines():
+                if not raw:
+                    continue
+                if raw.startswith(b'#'):
+                    if raw.startswith(b'# TYPE '):
+                        self._parse_type(raw)
+                    continue
+                try:
+                    metric_item = self._parse_line(raw)
+                except Exception as e:
+                    # print(f"Error parsing line '{raw}': {e}")
                     continue
-                    
-                metric_item['value'] = float(line_parts[1])
-                
-                if line_parts[0].endswith('}'):
-                    metric_item['key'] = line_parts[0].split('{')[0]
-                    # Handle labels
-                    label_part = line_parts[0].split('{')[1][:-1]
-                    if label_part:
-                        labels = label_part.split(',')
-                        for la in labels:
-                            if '=' in la:
-                                key, val = la.split('=', 1)
-                                metric_item['label'][key] = val.strip('"')
-                else:
-                    metric_item['key'] = line_parts[0]
-
-                metrics.append(metric_item)
-            except Exception as e:
-                # print(f"Error parsing line '{line}': {e}")
-                continue
-
-        # filter
-        if self._filter:
-            result = []
-            for item in metrics:
-                if item['key'] in self._filter:
-                    result.append(item)
-            
-            return result
+                if metric_item is not None:
+                    metrics.append(metric_item)
+        except Exception as e:
+            print(f"Error reading metrics from {self._url}: {e}")
+            self.error = str(e)
+            return []
+        finally:
+            response.close()
 
         return metrics
 
+    def interprete_buckets(self, timeout=5) -> dict:
+        """
+        抓取解析一次，按bucket分发
+        return: {bucket: [metric_item]}
+        """
+        metrics = self.interprete(timeout=timeout)
+        if self._buckets is None:
+            return {None: metrics}
 
-
-
-    
\ No newline at end of file
+        res = {bucket: [] for bucket in self._buckets}
+        for item in metrics:
+            for bucket in self._index.get(item['key'], ()):
+                res[bucket].append(item)
+        return res
@@ -0,0 +1,73 @@
+import socket
+import time
+from utils import utils
+from utils.metrics import Metrics
+from utils.http import make_session
+
+
+class ReadinessChecker(object):
+    """
+    探测Fabric网络是否就绪:
+    1. 所有peer/orderer的operations接口/healthz返回200
+    2. 所有CA端口可以建立TCP连接
+    3. 至少一个orderer的consensus_etcdraft_is_leader为1(raft已选出leader)
+    params:
+    timeout: 最长等待时间(s)
+    interval: 探测间隔(s)
+    """
+
+    def __init__(self, config, timeout=90, interval=2, session=None):
+        self._timeout = timeout
+        self._interval = interval
+        self._session = session if session is not None else make_session(retries=0)
+        endpoints = utils.get_node_endpoints(config)
+        self._health_urls = [item["url"][:-len("metrics")] + "healthz" for item in endpoints]
+        self._leader_metrics = [Metrics(item["url"], ["consensus_etcdraft_is_leader"], session=self._session)
+            for item in endpoints if item["node_type"] == "orderer"]
+        self._cas = utils.get_ca_endpoints(config)
+
+    def _healthy(self, url):
+        try:
+            return self._session.request("GET", url, timeout=self._interval).status_code == 200
+        except Exception:
+            return False
+
+    def _reachable(self, host, port):
+        try:
+            socket.create_connection((host, port), timeout=self._interval).close()
+            return True
+        except OSError:
+            return False
+
+    def _has_leader(self):
+        for metrics in self._leader_metrics:
+            if any(item['value'] == 1 for item in metrics.interprete(timeout=self._interval)):
+                return True
+        return False
+
+    def pending(self):
+        """
+        return: 尚未就绪的检查项列表, 为空表示全部就绪
+        """
+        res = [url for url in self._health_urls if not self._healthy(url)]
+        res += ["%s:%s" % ca for ca in self._cas if not self._reachable(*ca)]
+        # raft leader依赖orderer已启动, 其余就绪后再检查
+        if not res and not self._has_leader():
+            res.append("raft leader")
+        return res
+
+    def wait(self):
+        """
+        阻塞直到网络就绪或超时
+        return: (是否就绪, 等待时间)
+        """
+        start = time.time()
+        while True:
+            pending = self.pending()
+            elapsed = time.time() - start
+            if not pending:
+                return True, elapsed
+            if elapsed + self._interval > self._timeout:
+                print("Fabric network not ready after {:.1f}s: {}".format(elapsed, pending))
+                return False, elapsed
+            time.sleep(self._interval)
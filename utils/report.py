@@ -0,0 +1,138 @@
+import os
+import math
+import threading
+from html.parser import HTMLParser
+
+
+class _TableParser(HTMLParser):
+    """
+    只提取<table>中的单元格文本, 不依赖lxml/bs4
+    tables: [[[cell, ...], ...], ...]
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.tables = []
+        self._row = None
+        self._cell = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "table":
+            self.tables.append([])
+        elif tag == "tr" and self.tables:
+            self._row = []
+        elif tag in ("td", "th") and self._row is not None:
+            self._cell = []
+
+    def handle_endtag(self, tag):
+        if tag in ("td", "th") and self._cell is not None:
+            self._row.append("".join(self._cell).strip())
+            self._cell = None
+        elif tag == "tr" and self._row is not None:
+            if self._row:
+                self.tables[-1].append(self._row)
+            self._row = None
+
+    def handle_data(self, data):
+        if self._cell is not None:
+            self._cell.append(data)
+
+
+def _to_float(value):
+    try:
+        return float(value.split()[0])
+    except (ValueError, IndexError):
+        return math.nan
+
+
+def _find_table(tables, column):
+    """
+    按表头查找表格, 返回[{表头: 值}]
+    """
+    for table in tables:
+        if table and column in table[0]:
+            header = table[0]
+            return [dict(zip(header, row)) for row in table[1:]]
+    return []
+
+
+def _mean(values):
+    values = [v for v in values if not math.isnan(v)]
+    return sum(values) / len(values) if values else 0.0
+
+
+class CaliperReport(object):
+    """
+    解析caliper的report.html, 结果按文件(mtime, inode, size)缓存, 文件变化后重新解析
+    表格按表头定位, 不依赖表格在页面中的位置
+    """
+    SUMMARY_COLUMN = "Throughput (TPS)"
+    RESOURCE_COLUMN = "CPU%(avg)"
+
+    def __init__(self, reportfile):
+        self._report = reportfile
+        self._key = None
+        self._result = None
+        self._lock = threading.Lock()
+
+    def read(self):
+        """
+        return: {
+            "TPS", "Latency"(s), "CPU", "Mem": 兼容原有接口
+            "SendRate", "Succ", "Fail",
+            "latency_ms": {"min", "avg", "max"},
+            "containers": [{"name", "cpu_max", "cpu_avg", "mem_max", "mem_avg", ...}]
+        }
+        """
+        stat = os.stat(self._report)
+        key = (stat.st_mtime_ns, stat.st_ino, stat.st_size)
+        with self._lock:
+            if key != self._key:
+                self._result = self._parse()
+                self._key = key
+            return self._result
+
+    def _parse(self):
+        parser = _TableParser()
+        with open(self._report, encoding="utf-8") as f:
+            parser.feed(f.read())
+        parser.close()
+
+        summary = _find_table(parser.tables, self.SUMMARY_COLUMN)
+        if not summary:
+            raise ValueError("no summary table in %s" % self._report)
+        # 第一轮测试的结果
+        round0 = summary[0]
+        latency = {
+            "min": _to_float(round0.get("Min Latency (s)", "")) * 1000,
+            "avg": _to_float(round0.get("Avg Latency (s)", "")) * 1000,
+            "max": _to_float(round0.get("Max Latency (s)", "")) * 1000
+        }
+
+        containers = []
+        for row in _find_table(parser.tables, self.RESOURCE_COLUMN):
+            containers.append({
+                "name": row.get("Name", ""),
+                "cpu_max": _to_float(row.get("CPU%(max)", "")),
+                "cpu_avg": _to_float(row.get("CPU%(avg)", "")),
+                "mem_max": _to_float(row.get("Memory(max) [MB]", "")),
+                "mem_avg": _to_float(row.get("Memory(avg) [MB]", "")),
+                "traffic_in": _to_float(row.get("Traffic In [MB]", "")),
+                "traffic_out": _to_float(row.get("Traffic Out [MB]", "")),
+                "disc_read": _to_float(row.get("Disc Read [MB]", "")),
+                "disc_write": _to_float(row.get("Disc Write [MB]", ""))
+            })
+        # CPU/Mem只统计peer(不含orderer和ca)
+        peers = [c for c in containers if "orderer" not in c["name"] and "ca" not in c["name"]]
+
+        return {
+            "CPU": _mean([c["cpu_avg"] for c in peers]),
+            "Mem": _mean([c["mem_avg"] for c in peers]),
+            "Latency": _to_float(round0.get("Avg Latency (s)", "")),
+            "TPS": _to_float(round0.get("Throughput (TPS)", "")),
+            "SendRate": _to_float(round0.get("Send Rate (TPS)", "")),
+            "Succ": _to_float(round0.get("Succ", "")),
+            "Fail": _to_float(round0.get("Fail", "")),
+            "latency_ms": latency,
+            "containers": containers
+        }
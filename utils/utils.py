@@ -1,3 +1,5 @@
+import os
+import shutil
 import yaml
 import pandas as pd
 import pdb
@@ -52,4 +54,58 @@ def handler_metrics_prom(data):
 #     df = pd.DataFrame(data).astype("float")
 #     limits = df.mean() * 10
 #     limits = pd.DataFrame(limits).T
-#     return limits.to_dict()
\ No newline at end of file
+#     return limits.to_dict()
+def select_group(config_data, group):
+    """
+    只保留caliper-eval中group的peer/orderer/ca, 与export-config.py的group模式一致
+    """
+    members = config_data['caliper-eval']['group'][group]
+    for node_type in ("peer", "orderer", "ca"):
+        nodes = config_data['fabric-network'].get(node_type) or {}
+        for key in [key for key in nodes if key not in members]:
+            del nodes[key]
+    return config_data
+
+# 工作目录中由make generate/benchmark生成的文件, 不从模板复制
+WORKDIR_OUTPUTS = ("dist", "history", "report.html", "action.yaml", "crypto-config", ".cache",
+    ".crypto-key", "genesis.block", "mychannel.tx")
+
+def prepare_workdir(template, workdir):
+    """
+    多集群时每个控制器使用自己的caliper-deploy-tool副本, 避免dist/report.html/action.yaml/crypto互相覆盖
+    params: template: 原caliper-deploy-tool目录, workdir: 该控制器的工作目录
+    return: workdir
+    """
+    if os.path.abspath(template) == os.path.abspath(workdir):
+        return workdir
+    def ignore(src, names):
+        skip = [name for name in names if name in WORKDIR_OUTPUTS]
+        # fabric二进制体积较大, 以软链接共享
+        if os.path.abspath(src) == os.path.abspath(os.path.join(template, "benchmarks", "config_raft")):
+            skip.append("bin")
+        return skip
+    # ansible/中的playbook以相对路径../../dist引用dist, 必须复制而不能软链接
+    shutil.copytree(template, workdir, ignore=ignore, dirs_exist_ok=True)
+    fabric_bin = os.path.abspath(os.path.join(template, "benchmarks", "config_raft", "bin"))
+    link = os.path.join(workdir, "benchmarks", "config_raft", "bin")
+    if os.path.isdir(fabric_bin) and not os.path.lexists(link):
+        os.symlink(fabric_bin, link)
+    return workdir
+
+def get_dns_server(config_data):
+    """
+    return: 节点使用的dnsserver, 即CoreDNS/NFS所在主机的地址
+    """
+    for node_type in ("peer", "orderer", "ca"):
+        for i in config_data['fabric-network'].get(node_type) or {}:
+            return config_data['fabric-network'][node_type][i]['dnsserver']
+    return None
+
+def get_ca_endpoints(config_data):
+    """
+    return: [(host, port)] 所有CA的监听地址
+    """
+    res = []
+    for i in config_data['fabric-network'].get('ca', {}) or {}:
+        res.append((config_data['fabric-network']['ca'][i]['host'], config_data['fabric-network']['ca'][i]['port']))
+    return res